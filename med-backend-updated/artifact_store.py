@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+
+# "local" keeps generated files on this host's disk and serves them from /artifacts/<id>
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "local").lower()
+ARTIFACT_STORE_PATH = os.getenv("ARTIFACT_STORE_PATH", "artifacts")
+# Artifacts not stored again for this long are removed at startup; 0 keeps them forever
+ARTIFACT_RETENTION_SECONDS = int(os.getenv("ARTIFACT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# "cloudinary" also copies each artifact to Cloudinary in the background; "none" keeps it local only
+ARTIFACT_REPLICATION = os.getenv("ARTIFACT_REPLICATION", "cloudinary").lower()
+
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+ARTIFACT_CONTENT_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv",
+    ".jsonl": "application/x-ndjson",
+}
+
+
+def artifact_content_type(name):
+    extension = os.path.splitext(name)[1].lower()
+    return (ARTIFACT_CONTENT_TYPES.get(extension)
+            or mimetypes.guess_type(name)[0]
+            or "application/octet-stream")
+
+
+class LocalArtifactStore:
+    """Files addressed by the sha256 of their content under ``root``.
+
+    Each artifact lives at ``<root>/<id[:2]>/<id>`` next to a ``<id>.json`` sidecar with
+    its download name, content type and size. Identical content is stored once and keeps
+    the name it was first stored under, so links already handed out don't change.
+    """
+
+    def __init__(self, root=ARTIFACT_STORE_PATH):
+        self.root = root
+
+    def _blob_path(self, artifact_id):
+        return os.path.join(self.root, artifact_id[:2], artifact_id)
+
+    def _meta_path(self, artifact_id):
+        return self._blob_path(artifact_id) + ".json"
+
+    def put_file(self, source_path, name, chunk_size=1024 * 1024):
+        """Move ``source_path`` into the store and return its metadata (``id`` included)."""
+        digest = hashlib.sha256()
+        size = 0
+        with open(source_path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+                size += len(block)
+
+        artifact_id = digest.hexdigest()
+        blob_path = self._blob_path(artifact_id)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if os.path.exists(blob_path):
+            os.remove(source_path)
+            # Storing the content again restarts its retention period
+            os.utime(blob_path)
+            if os.path.exists(self._meta_path(artifact_id)):
+                existing = self.describe(artifact_id)
+                if existing.get("name") != name:
+                    return existing
+        else:
+            # Copy next to the final path first so readers never see a partial file
+            fd, staging_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), suffix=".part")
+            os.close(fd)
+            shutil.move(source_path, staging_path)
+            os.replace(staging_path, blob_path)
+
+        metadata = {
+            "id": artifact_id,
+            "name": name,
+            "contentType": artifact_content_type(name),
+            "size": size,
+            "createdAt": time.time(),
+        }
+        with open(self._meta_path(artifact_id), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        return metadata
+
+    def describe(self, artifact_id):
+        """Metadata for ``artifact_id``, or ``None`` if it is malformed or not stored."""
+        if not ARTIFACT_ID_PATTERN.match(artifact_id or ""):
+            return None
+        if not os.path.exists(self._blob_path(artifact_id)):
+            return None
+        try:
+            with open(self._meta_path(artifact_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"id": artifact_id, "name": artifact_id, "contentType": "application/octet-stream",
+                    "size": os.path.getsize(self._blob_path(artifact_id))}
+
+    def path(self, artifact_id):
+        return self._blob_path(artifact_id)
+
+    def purge(self, older_than):
+        """Delete artifacts (and leftover partial files) last stored before the ``older_than`` timestamp."""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for folder in os.scandir(self.root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".json") or entry.stat().st_mtime >= older_than:
+                    continue
+                for path in (entry.path, entry.path + ".json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                if not entry.name.endswith(".part"):
+                    removed += 1
+        return removed
+
+
+def get_artifact_store(name=None):
+    name = (name or ARTIFACT_STORE).lower()
+    if name == "local":
+        return LocalArtifactStore()
+    raise ValueError(f"Unknown artifact store: {name}")
@@ -0,0 +1,114 @@
+import os
+import asyncio
+
+# "stream" consumes run events as they happen, "poll" uses adaptive backoff polling only
+ASSISTANT_RUN_MODE = os.getenv("ASSISTANT_RUN_MODE", "stream").lower()
+
+# Per-request timeout for OpenAI calls; asyncio.wait_for cancels the HTTP request itself
+REQUEST_TIMEOUT = 30
+
+# Adaptive polling: start fast, back off geometrically up to the cap
+POLL_INITIAL_DELAY = float(os.getenv("ASSISTANT_POLL_INITIAL_DELAY", "0.25"))
+POLL_MAX_DELAY = float(os.getenv("ASSISTANT_POLL_MAX_DELAY", "4"))
+POLL_BACKOFF = 1.6
+
+TERMINAL_RUN_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+TERMINAL_RUN_EVENTS = {
+    "thread.run.completed",
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+    "thread.run.incomplete",
+    "thread.run.requires_action",
+}
+
+
+async def poll_run(client, thread_id, run_id, should_cancel, max_wait):
+    """Poll a run with adaptive backoff until it reaches a terminal status and return it."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait
+    delay = POLL_INITIAL_DELAY
+
+    while True:
+        if should_cancel():
+            raise asyncio.CancelledError()
+
+        try:
+            run = await asyncio.wait_for(
+                client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id),
+                REQUEST_TIMEOUT
+            )
+            if run.status in TERMINAL_RUN_STATUSES:
+                return run
+        except asyncio.TimeoutError:
+            print("⚠️ Timeout while polling run status, retrying...")
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise TimeoutError("Timeout waiting for assistant response")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+
+async def _consume_run_stream(client, thread_id, assistant_id, should_cancel, state):
+    stream = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        stream=True
+    )
+    async with stream:
+        async for event in stream:
+            if should_cancel():
+                raise asyncio.CancelledError()
+
+            if event.event == "thread.run.created":
+                state["run_id"] = event.data.id
+            elif event.event == "thread.message.completed":
+                state["message"] = event.data
+            elif event.event in TERMINAL_RUN_EVENTS:
+                state["run"] = event.data
+                return
+            elif event.event == "error":
+                raise RuntimeError(f"Run stream error: {event.data}")
+
+
+async def run_assistant(client, thread_id, assistant_id, should_cancel, max_wait, mode=None):
+    """Start an assistant run on ``thread_id`` and wait for it to finish.
+
+    Returns ``(run, message)``. In stream mode ``message`` is the assistant message
+    delivered by the stream, so callers can skip listing the thread; it is ``None``
+    when the run was resolved by polling. If the stream drops before a terminal
+    event the run is polled to completion instead.
+    """
+    mode = mode or ASSISTANT_RUN_MODE
+
+    if mode == "stream":
+        state = {"run_id": None, "run": None, "message": None}
+        try:
+            await asyncio.wait_for(
+                _consume_run_stream(client, thread_id, assistant_id, should_cancel, state),
+                max_wait
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout waiting for assistant response")
+        except (asyncio.CancelledError, RuntimeError):
+            raise
+        except Exception as e:
+            if not state["run_id"]:
+                raise
+            print(f"⚠️ Run stream interrupted ({e}), falling back to polling...")
+
+        run = state["run"]
+        if run is None:
+            if not state["run_id"]:
+                raise RuntimeError("Run stream ended before the run was created")
+            run = await poll_run(client, thread_id, state["run_id"], should_cancel, max_wait)
+            return run, None
+        return run, state["message"]
+
+    run = await asyncio.wait_for(
+        client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id),
+        REQUEST_TIMEOUT
+    )
+    run = await poll_run(client, thread_id, run.id, should_cancel, max_wait)
+    return run, None
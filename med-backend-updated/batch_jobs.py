@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import json
+import uuid
+import asyncio
+from pathlib import Path
+
+# Where request/result JSONL files for offline explanation jobs are kept
+BATCH_JOB_FOLDER = os.getenv("BATCH_JOB_FOLDER", os.path.join("uploads", "batch_jobs"))
+# "openai" submits to the Batch API, "local" processes the file in-process with a deterministic stand-in
+BATCH_BACKEND = os.getenv("EXPLANATION_BATCH_BACKEND", "openai").lower()
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+# The Batch API accepts at most 50,000 requests per input file
+BATCH_MAX_REQUESTS = 50000
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch statuses after which no more output will appear
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_request_line(custom_id, model, instructions, prompt):
+    """One JSONL line of a chat-completions batch request."""
+    messages = []
+    if instructions:
+        messages.append({"role": "system", "content": instructions})
+    messages.append({"role": "user", "content": prompt})
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages},
+    }, ensure_ascii=False)
+
+
+def write_request_file(path, lines):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+    return path
+
+
+def remove_job_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_result_file(path):
+    """Map every ``custom_id`` in a batch output file to ``{"content": ...}`` or ``{"error": ...}``."""
+    results = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            custom_id = row.get("custom_id")
+            response = row.get("response") or {}
+            if row.get("error"):
+                results[custom_id] = {"error": str(row["error"].get("message", row["error"]))}
+            elif response.get("status_code") != 200:
+                results[custom_id] = {"error": f"HTTP {response.get('status_code')}"}
+            else:
+                try:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    results[custom_id] = {"content": content}
+                except (KeyError, IndexError, TypeError):
+                    results[custom_id] = {"error": "Malformed response body"}
+    return results
+
+
+def fake_explanation(body):
+    """Deterministic stand-in reply for a chat-completions request body."""
+    prompt = body["messages"][-1]["content"]
+    match = re.search(r"Correct Answer:\s*([A-Z]?)", prompt)
+    label = match.group(1) if match and match.group(1) else "?"
+    return json.dumps({"explanation": f"Option {label} is the correct answer. (offline stand-in)"})
+
+
+def run_local_batch(request_path, output_path, respond=fake_explanation):
+    """Process a batch request file and write an output file in the Batch API format."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(request_path, encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as out:
+        for n, line in enumerate(src, start=1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            row = {"id": f"local_req_{n}", "custom_id": request["custom_id"], "response": None, "error": None}
+            try:
+                content = respond(request["body"])
+                row["response"] = {
+                    "status_code": 200,
+                    "request_id": f"local_{n}",
+                    "body": {
+                        "object": "chat.completion",
+                        "model": request["body"].get("model"),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                    },
+                }
+            except Exception as e:
+                row["error"] = {"code": "local_error", "message": str(e)}
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return output_path
+
+
+class OpenAIBatchBackend:
+    """Submits request files to the OpenAI Batch API and downloads the result file."""
+
+    def __init__(self, client, poll_interval=BATCH_POLL_INTERVAL):
+        self.client = client
+        self.poll_interval = poll_interval
+
+    async def submit(self, request_path):
+        uploaded = await self.client.files.create(file=Path(request_path), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    async def cancel(self, batch_id):
+        try:
+            await self.client.batches.cancel(batch_id)
+        except Exception as e:
+            print(f"⚠️ Failed to cancel batch {batch_id}: {e}")
+
+    async def wait(self, batch_id, output_path, should_cancel):
+        try:
+            while True:
+                if should_cancel():
+                    raise asyncio.CancelledError()
+
+                batch = await self.client.batches.retrieve(batch_id)
+                if batch.status in BATCH_TERMINAL_STATUSES:
+                    # A batch whose requests all failed completes with only an error file
+                    if not (batch.output_file_id or batch.error_file_id):
+                        raise RuntimeError(f"Batch {batch_id} ended with status {batch.status} and no result files")
+                    break
+
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            # Cancelling the task lands here too; stop the batch so it doesn't keep running and billing
+            await asyncio.shield(self.cancel(batch_id))
+            raise
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "wb") as out:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = await self.client.files.content(file_id)
+                    out.write(content.content)
+        return output_path
+
+
+class LocalBatchBackend:
+    """Offline stand-in that processes request files in-process with ``respond(body)``."""
+
+    def __init__(self, respond=fake_explanation):
+        self.respond = respond
+        self.jobs = {}
+
+    async def submit(self, request_path):
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        self.jobs[batch_id] = request_path
+        return batch_id
+
+    async def wait(self, batch_id, output_path, should_cancel):
+        if should_cancel():
+            raise asyncio.CancelledError()
+        request_path = self.jobs.pop(batch_id)
+        return await asyncio.to_thread(run_local_batch, request_path, output_path, self.respond)
+
+
+def get_batch_backend(client, name=None):
+    name = (name or BATCH_BACKEND).lower()
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "openai":
+        return OpenAIBatchBackend(client)
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+# Process a request file offline: python batch_jobs.py requests.jsonl results.jsonl
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python batch_jobs.py <requests.jsonl> <results.jsonl>")
+        sys.exit(1)
+    run_local_batch(sys.argv[1], sys.argv[2])
+    print(f"✅ Wrote {sys.argv[2]}")
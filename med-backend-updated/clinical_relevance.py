@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import math
+import time
+import asyncio
+import hashlib
+
+from q_generation_func import is_clinically_relevant
+from sqlite_db import SQLiteDatabase
+
+# "hybrid" decides clear cases locally and asks the model about the rest, "model" always asks
+# the model, "local" never does (ambiguous documents are treated as relevant)
+RELEVANCE_CHECK = os.getenv("RELEVANCE_CHECK", "hybrid").lower()
+RELEVANCE_VOCABULARY_PATH = os.getenv(
+    "RELEVANCE_VOCABULARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "clinical_vocabulary.txt")
+)
+# Local score at or above which a document is relevant (given enough distinct terms), and at or below
+# which it is not; anything in between is ambiguous
+RELEVANCE_ACCEPT_SCORE = float(os.getenv("RELEVANCE_ACCEPT_SCORE", "0.08"))
+RELEVANCE_REJECT_SCORE = float(os.getenv("RELEVANCE_REJECT_SCORE", "0.015"))
+RELEVANCE_MIN_TERMS = int(os.getenv("RELEVANCE_MIN_TERMS", "6"))
+# Texts shorter than this many words are always ambiguous
+RELEVANCE_MIN_WORDS = int(os.getenv("RELEVANCE_MIN_WORDS", "50"))
+# Verdicts per document hash; empty disables the cache
+RELEVANCE_CACHE_PATH = os.getenv("RELEVANCE_CACHE_PATH", "relevance_cache.sqlite3")
+
+# Skip chunks without clinical content (front matter, indexes, bibliographies) before generation
+MCQ_CHUNK_GATING = os.getenv("MCQ_CHUNK_GATING", "1") == "1"
+# Chunks scoring below this, or with fewer words, are not sent to generation
+MCQ_CHUNK_MIN_SCORE = float(os.getenv("MCQ_CHUNK_MIN_SCORE", "0.02"))
+MCQ_CHUNK_MIN_WORDS = int(os.getenv("MCQ_CHUNK_MIN_WORDS", "40"))
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+\d*", re.UNICODE)
+MIN_STEM_LENGTH = 4
+
+# Reference-list markers: "(2019)", "2019;", "et al.", DOIs, volume and page abbreviations
+CITATION_PATTERN = re.compile(r"\((?:19|20)\d{2}[a-z]?\)|\b(?:19|20)\d{2}[a-z]?[;:]|\bet al\.|\bdoi\b|\bvol\.|\bpp\.", re.IGNORECASE)
+# Index and table-of-contents lines: a short entry ending in page numbers
+PAGE_REFERENCE_LINE = re.compile(r"^.{2,80}?[\s,.]\d{1,4}(?:\s*[,–-]\s*\d{1,4})*\s*$")
+FRONT_MATTER_PATTERN = re.compile(
+    r"\bisbn\b|copyright|©|all rights reserved|wszelkie prawa zastrzeżone|table of contents|spis treści"
+    r"|acknowledg|podziękowania|printed in|wydawnictwo|publisher",
+    re.IGNORECASE
+)
+# Share of citation markers per word, and of page-numbered lines, that mark a chunk as a bibliography or index
+BIBLIOGRAPHY_CITATION_SHARE = 0.03
+INDEX_LINE_SHARE = 0.5
+
+
+def load_clinical_vocabulary(path=RELEVANCE_VOCABULARY_PATH):
+    """Map each vocabulary term to its weight; see clinical_vocabulary.txt for the format."""
+    vocabulary = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                term, weight = line.split()
+                vocabulary[term.lower()] = float(weight)
+    return vocabulary
+
+
+class RelevanceScorer:
+    """Weighted density of clinical vocabulary in a text.
+
+    Each word is matched to its longest vocabulary stem; the score sums the matched
+    weights, dampened per term like TF-IDF (``weight * (1 + ln(count))``), and divides
+    by the number of words, so repeating one term cannot make a document relevant.
+    """
+
+    def __init__(self, vocabulary):
+        self.exact = vocabulary
+        self.stems = {term: weight for term, weight in vocabulary.items() if len(term) >= MIN_STEM_LENGTH}
+        self.max_stem = max((len(term) for term in self.stems), default=0)
+
+    def match(self, word):
+        for length in range(min(len(word), self.max_stem), MIN_STEM_LENGTH - 1, -1):
+            if word[:length] in self.stems:
+                return word[:length]
+        return word if word in self.exact else None
+
+    def score(self, text):
+        counts = {}
+        words = 0
+        for word in WORD_PATTERN.findall(text.lower()):
+            words += 1
+            term = self.match(word)
+            if term:
+                counts[term] = counts.get(term, 0) + 1
+        weighted = sum(self.exact[term] * (1 + math.log(count)) for term, count in counts.items())
+        return {
+            "score": round(weighted / words, 4) if words else 0.0,
+            "terms": len(counts),
+            "words": words,
+        }
+
+    def verdict(self, scored):
+        """True or False for clear cases, None when the document is ambiguous."""
+        if scored["words"] < RELEVANCE_MIN_WORDS:
+            return None
+        if scored["score"] >= RELEVANCE_ACCEPT_SCORE and scored["terms"] >= RELEVANCE_MIN_TERMS:
+            return True
+        if scored["score"] <= RELEVANCE_REJECT_SCORE:
+            return False
+        return None
+
+
+def relevance_cache_key(doc_hash, mode):
+    """Cache key for a document's verdict under the current mode and local thresholds."""
+    settings = [mode, RELEVANCE_ACCEPT_SCORE, RELEVANCE_REJECT_SCORE, RELEVANCE_MIN_TERMS, RELEVANCE_MIN_WORDS]
+    return hashlib.sha256(json.dumps([doc_hash, settings]).encode("utf-8")).hexdigest()
+
+
+class RelevanceCache:
+    """Relevance verdicts keyed by ``relevance_cache_key`` in a local SQLite file."""
+
+    def __init__(self, path=RELEVANCE_CACHE_PATH):
+        self.path = path
+        self.db = SQLiteDatabase(path, (
+            """CREATE TABLE IF NOT EXISTS relevance_verdicts (
+                doc_hash TEXT PRIMARY KEY, relevant INTEGER, source TEXT, score REAL, created_at REAL)""",
+        ))
+
+    async def get(self, key):
+        rows = await asyncio.to_thread(
+            self.db.run, "SELECT relevant, source, score FROM relevance_verdicts WHERE doc_hash = ?", (key,), True
+        )
+        if not rows:
+            return None
+        return {"relevant": bool(rows[0]["relevant"]), "source": rows[0]["source"], "score": rows[0]["score"]}
+
+    async def put(self, key, verdict):
+        await asyncio.to_thread(
+            self.db.run,
+            "INSERT OR REPLACE INTO relevance_verdicts (doc_hash, relevant, source, score, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, int(verdict["relevant"]), verdict["source"], verdict.get("score"), time.time())
+        )
+
+
+class RelevanceChecker:
+    """Clinical relevance of a document from its opening text, local first and cached by document hash."""
+
+    def __init__(self, client, mode=RELEVANCE_CHECK, scorer=None, cache=None):
+        if mode not in ("hybrid", "model", "local"):
+            raise ValueError(f"Unknown relevance check mode: {mode}")
+        self.client = client
+        self.mode = mode
+        self.scorer = scorer
+        self.cache = cache
+        self.stats = {"cached": 0, "local": 0, "model": 0}
+
+    async def check(self, text, doc_hash=None):
+        """Verdict dict: ``relevant``, ``source`` ("cache", "local" or "model") and the local ``score``."""
+        key = relevance_cache_key(doc_hash, self.mode) if self.cache and doc_hash else None
+        if key:
+            cached = await self.cache.get(key)
+            if cached:
+                self.stats["cached"] += 1
+                return {**cached, "source": "cache"}
+
+        scored = self.scorer.score(text) if self.scorer else None
+        decided = self.scorer.verdict(scored) if scored and self.mode != "model" else None
+        # Local mode lets ambiguous documents through; that default is not a verdict worth caching
+        defaulted = decided is None and self.mode == "local"
+        if defaulted:
+            decided = True
+
+        if decided is not None:
+            verdict = {"relevant": decided, "source": "local"}
+        else:
+            verdict = {"relevant": await is_clinically_relevant(self.client, text), "source": "model"}
+        verdict["score"] = scored["score"] if scored else None
+        self.stats[verdict["source"]] += 1
+
+        if key and not defaulted:
+            await self.cache.put(key, verdict)
+        return verdict
+
+    def describe(self):
+        return {**self.stats, "mode": self.mode}
+
+
+class ChunkGate:
+    """Cheap local triage of chunks before generation.
+
+    ``assess`` returns the chunk's local relevance score and a ``reason`` when the chunk
+    should be skipped: too little text, a bibliography, an index or table of contents,
+    front matter, or too little clinical vocabulary.
+    """
+
+    def __init__(self, scorer, min_score=MCQ_CHUNK_MIN_SCORE, min_words=MCQ_CHUNK_MIN_WORDS):
+        self.scorer = scorer
+        self.min_score = min_score
+        self.min_words = min_words
+
+    def assess(self, text):
+        scored = self.scorer.score(text)
+        words = scored["words"]
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+        if len(lines) >= 5 and sum(1 for line in lines if PAGE_REFERENCE_LINE.match(line)) / len(lines) >= INDEX_LINE_SHARE:
+            reason = "index or table of contents"
+        elif words and len(CITATION_PATTERN.findall(text)) / words >= BIBLIOGRAPHY_CITATION_SHARE:
+            reason = "bibliography"
+        elif words < self.min_words:
+            reason = "too little text"
+        elif scored["score"] < self.min_score:
+            reason = "front matter" if FRONT_MATTER_PATTERN.search(text) else "low clinical content"
+        else:
+            reason = None
+        return {"score": scored["score"], "reason": reason}
+
+
+def get_chunk_gate():
+    """The chunk gate, or ``None`` when MCQ_CHUNK_GATING is off."""
+    if not MCQ_CHUNK_GATING:
+        return None
+    return ChunkGate(RelevanceScorer(load_clinical_vocabulary()))
+
+
+def get_relevance_checker(client, mode=None):
+    mode = (mode or RELEVANCE_CHECK).lower()
+    scorer = RelevanceScorer(load_clinical_vocabulary()) if mode != "model" else None
+    cache = RelevanceCache() if RELEVANCE_CACHE_PATH else None
+    return RelevanceChecker(client, mode, scorer, cache)
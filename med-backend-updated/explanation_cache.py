@@ -0,0 +1,115 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+
+from sqlite_db import SQLiteDatabase
+
+EXPLANATION_CACHE_PATH = os.getenv("EXPLANATION_CACHE_PATH", "explanation_cache.sqlite3")
+# Most explanations kept on disk; 0 disables the cache
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "100000"))
+# "lru" evicts the least recently used explanations first, "fifo" the oldest stored ones
+EXPLANATION_CACHE_POLICY = os.getenv("EXPLANATION_CACHE_POLICY", "lru").lower()
+
+EVICTION_ORDER = {"lru": "last_used", "fifo": "created_at"}
+
+
+def normalize_prompt_text(text):
+    return re.sub(r"\s+", " ", str(text or "")).strip()
+
+
+def explanation_cache_key(block, preamble=""):
+    """Content hash of an explanation prompt.
+
+    ``block`` is the question block from ``format_question_block`` (question text,
+    labeled options and correct label); ``preamble`` separates prompt variants that
+    steer the answer differently. Whitespace differences do not change the key.
+    """
+    payload = json.dumps([normalize_prompt_text(preamble), normalize_prompt_text(block)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExplanationCache:
+    """Explanations keyed by ``explanation_cache_key`` in a local SQLite file, capped at ``max_entries``."""
+
+    def __init__(self, path=EXPLANATION_CACHE_PATH, max_entries=EXPLANATION_CACHE_MAX_ENTRIES,
+                 policy=EXPLANATION_CACHE_POLICY):
+        if policy not in EVICTION_ORDER:
+            raise ValueError(f"Unknown explanation cache policy: {policy}")
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.policy = policy
+        self.db = SQLiteDatabase(path, (
+            """CREATE TABLE IF NOT EXISTS explanation_cache (
+                key TEXT PRIMARY KEY, explanation TEXT, created_at REAL, last_used REAL)""",
+            "CREATE INDEX IF NOT EXISTS idx_explanation_cache_used ON explanation_cache (last_used)",
+            "CREATE INDEX IF NOT EXISTS idx_explanation_cache_created ON explanation_cache (created_at)",
+        ))
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+    def _get_many_sync(self, keys, chunk_size=500):
+        found = {}
+        with self.db.connect() as conn:
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = conn.execute(
+                    f"SELECT key, explanation FROM explanation_cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update((row["key"], row["explanation"]) for row in rows)
+                if rows and self.policy == "lru":
+                    conn.executemany(
+                        "UPDATE explanation_cache SET last_used = ? WHERE key = ?",
+                        [(time.time(), row["key"]) for row in rows]
+                    )
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def _put_many_sync(self, items):
+        now = time.time()
+        with self.db.connect() as conn:
+            conn.executemany(
+                """INSERT INTO explanation_cache (key, explanation, created_at, last_used) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET explanation = excluded.explanation, last_used = excluded.last_used""",
+                [(key, explanation, now, now) for key, explanation in items]
+            )
+            count = conn.execute("SELECT COUNT(*) FROM explanation_cache").fetchone()[0]
+            if count > self.max_entries:
+                order = EVICTION_ORDER[self.policy]
+                conn.execute(
+                    f"""DELETE FROM explanation_cache WHERE key IN (
+                        SELECT key FROM explanation_cache ORDER BY {order} LIMIT ?)""",
+                    (count - self.max_entries,)
+                )
+                self.stats["evicted"] += count - self.max_entries
+        self.stats["stored"] += len(items)
+
+    async def get_many(self, keys):
+        """Map each cached key in ``keys`` to its explanation."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        return await asyncio.to_thread(self._get_many_sync, keys)
+
+    async def put_many(self, items):
+        """Store ``(key, explanation)`` pairs, evicting per the policy when over the cap."""
+        items = list(items)
+        if items:
+            await asyncio.to_thread(self._put_many_sync, items)
+
+    async def put(self, key, explanation):
+        await self.put_many([(key, explanation)])
+
+    def describe(self):
+        return {**self.stats, "path": self.path, "maxEntries": self.max_entries, "policy": self.policy}
+
+
+def get_explanation_cache(max_entries=None):
+    """The configured cache, or ``None`` when EXPLANATION_CACHE_MAX_ENTRIES is 0."""
+    max_entries = EXPLANATION_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    if max_entries <= 0:
+        return None
+    return ExplanationCache(max_entries=max_entries)
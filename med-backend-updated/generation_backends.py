@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+
+from assistant_runs import REQUEST_TIMEOUT, run_assistant
+
+# Backend per pipeline: "assistants" (threads and runs), "chat" (one JSON-mode chat
+# completion using the assistant's model and instructions) or "fake" (deterministic, offline)
+EXPLANATION_BACKEND = os.getenv("EXPLANATION_BACKEND", "assistants").lower()
+MCQ_BACKEND = os.getenv("MCQ_BACKEND", "assistants").lower()
+# Overrides the assistant's own model in chat mode
+CHAT_BACKEND_MODEL = os.getenv("CHAT_BACKEND_MODEL")
+
+JSON_REPLY_INSTRUCTION = "Reply with a single JSON object."
+
+
+class NonTextReply(Exception):
+    """The model answered with something other than text, e.g. a refusal block."""
+
+    def __init__(self, kind):
+        super().__init__(f"Non-text reply ({kind})")
+        self.kind = kind
+
+
+class AssistantsBackend:
+    """Thread + run on an assistant; the reply is the first content block of the last message."""
+
+    def __init__(self, client, assistant_id, max_wait):
+        self.client = client
+        self.assistant_id = assistant_id
+        self.max_wait = max_wait
+
+    async def generate(self, prompt, should_cancel):
+        thread = await asyncio.wait_for(
+            self.client.beta.threads.create(messages=[{"role": "user", "content": prompt}]),
+            REQUEST_TIMEOUT
+        )
+        run, message = await run_assistant(
+            self.client,
+            thread.id,
+            self.assistant_id,
+            should_cancel=should_cancel,
+            max_wait=self.max_wait
+        )
+        if run.status != "completed":
+            raise RuntimeError(f"Run ended with status: {run.status}")
+
+        if message is None or not message.content:
+            messages = await asyncio.wait_for(
+                self.client.beta.threads.messages.list(thread_id=thread.id), REQUEST_TIMEOUT
+            )
+            if not messages.data or not messages.data[0].content:
+                raise RuntimeError("Failed to retrieve messages")
+            message = messages.data[0]
+
+        block = message.content[0]
+        if not hasattr(block, "text"):
+            raise NonTextReply(type(block).__name__)
+        return block.text.value
+
+
+class ChatCompletionsBackend:
+    """One JSON-mode chat completion per prompt, reusing the assistant's model and instructions."""
+
+    def __init__(self, client, assistant_id, max_wait, model=CHAT_BACKEND_MODEL):
+        self.client = client
+        self.assistant_id = assistant_id
+        self.max_wait = max_wait
+        self.model = model
+        self.instructions = None
+        self.lock = asyncio.Lock()
+
+    async def _load_assistant(self):
+        async with self.lock:
+            if self.instructions is None:
+                assistant = await asyncio.wait_for(
+                    self.client.beta.assistants.retrieve(self.assistant_id), REQUEST_TIMEOUT
+                )
+                self.model = self.model or assistant.model
+                self.instructions = assistant.instructions or ""
+
+    async def generate(self, prompt, should_cancel):
+        if should_cancel():
+            raise asyncio.CancelledError()
+        if self.instructions is None:
+            await self._load_assistant()
+
+        response = await asyncio.wait_for(
+            self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": f"{self.instructions}\n\n{JSON_REPLY_INSTRUCTION}".strip()},
+                    {"role": "user", "content": prompt},
+                ],
+                response_format={"type": "json_object"},
+            ),
+            self.max_wait
+        )
+        message = response.choices[0].message
+        if getattr(message, "refusal", None) or not message.content:
+            raise NonTextReply("refusal" if getattr(message, "refusal", None) else "empty")
+        return message.content
+
+
+def fake_explanation_text(block):
+    match = re.search(r"Correct Answer:\s*([A-Z]?)", block)
+    label = match.group(1) if match and match.group(1) else "?"
+    return f"Option {label} is the correct answer. (offline stand-in)"
+
+
+def fake_mcq_reply(prompt):
+    words = prompt.split()
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    subject = " ".join(words[:6]) or "the text"
+    return {
+        "topic": " ".join(words[:3]) or "Unknown Topic",
+        "questions": [{
+            "question": f"Which statement about \"{subject}\" is supported by the text? [{digest}]",
+            "options": {
+                "A": "It is described in the text.",
+                "B": "It is contradicted by the text.",
+                "C": "It is not mentioned in the text.",
+                "D": "None of the above.",
+            },
+            "answer": "A",
+            "explanation": "The passage describes it directly. (offline stand-in)",
+        }],
+    }
+
+
+class FakeBackend:
+    """Deterministic replies shaped like each pipeline's real output, for tests and offline runs."""
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    async def generate(self, prompt, should_cancel):
+        if should_cancel():
+            raise asyncio.CancelledError()
+        await asyncio.sleep(0)
+
+        if self.kind == "mcq":
+            return json.dumps(fake_mcq_reply(prompt), ensure_ascii=False)
+
+        # Batched explanation prompts carry "[key]" headers before each question block
+        parts = re.split(r"^\[(\w+)\]$", prompt, flags=re.MULTILINE)
+        if len(parts) > 1:
+            keys, blocks = parts[1::2], parts[2::2]
+            return json.dumps({key: fake_explanation_text(block) for key, block in zip(keys, blocks)})
+        return json.dumps({"explanation": fake_explanation_text(prompt)})
+
+
+def get_generation_backend(client, kind, assistant_id, max_wait, name=None):
+    """Backend for the ``kind`` pipeline ("explanation" or "mcq"), configured per pipeline."""
+    name = (name or (MCQ_BACKEND if kind == "mcq" else EXPLANATION_BACKEND)).lower()
+    if name == "assistants":
+        return AssistantsBackend(client, assistant_id, max_wait)
+    if name == "chat":
+        return ChatCompletionsBackend(client, assistant_id, max_wait)
+    if name == "fake":
+        return FakeBackend(kind)
+    raise ValueError(f"Unknown generation backend: {name}")
@@ -0,0 +1,153 @@
+import os
+import time
+import asyncio
+
+# Seconds the subject/topic hierarchy is served from memory before it is reloaded; 0 queries every time
+HIERARCHY_CACHE_TTL = float(os.getenv("HIERARCHY_CACHE_TTL", "300"))
+
+
+def name_key(name):
+    # MySQL's default collations compare names case-insensitively and ignore trailing spaces
+    return str(name or "").rstrip().casefold()
+
+
+class DirectHierarchy:
+    """Subject and topic lookups as individual queries through ``execute_query``.
+
+    Id lookups return ``None`` when nothing matches; listings return the rows, or
+    ``None`` when the query failed.
+    """
+
+    def __init__(self, execute_query):
+        self.execute_query = execute_query
+
+    async def _first_id(self, query, params):
+        rows = (await self.execute_query(query, params)).get("data", [])
+        return rows[0]["id"] if rows else None
+
+    async def subject_id(self, category_id, subject_name):
+        return await self._first_id(
+            "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s", (category_id, subject_name)
+        )
+
+    async def topic_id(self, subject_id, topic_name):
+        return await self._first_id(
+            "SELECT id FROM topics WHERE subjectId = %s AND topicName = %s", (subject_id, topic_name)
+        )
+
+    async def subjects(self, category_id):
+        response = await self.execute_query("SELECT * FROM subject WHERE categoryId = %s", (category_id,))
+        return None if response.get("error") else response.get("data", [])
+
+    async def topics(self, subject_id):
+        response = await self.execute_query("SELECT * FROM topics WHERE subjectId = %s", (subject_id,))
+        return None if response.get("error") else response.get("data", [])
+
+    def invalidate(self):
+        pass
+
+    def describe(self):
+        return {"cached": False}
+
+
+class CachedHierarchy(DirectHierarchy):
+    """The ``subject`` and ``topics`` tables held in memory for ``ttl`` seconds.
+
+    Both tables are loaded with one query each and indexed by parent id and name.
+    Names not found in memory (e.g. added since the last load) fall back to a query,
+    and so does everything while the tables cannot be loaded.
+    """
+
+    def __init__(self, execute_query, ttl=HIERARCHY_CACHE_TTL):
+        super().__init__(execute_query)
+        self.ttl = ttl
+        self.lock = asyncio.Lock()
+        self.loaded_at = None
+        self.subjects_by_category = {}
+        self.subject_ids = {}
+        self.topics_by_subject = {}
+        self.topic_ids = {}
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    def _fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def _load(self):
+        if self._fresh():
+            return True
+        async with self.lock:
+            if self._fresh():
+                return True
+            subjects = await self.execute_query("SELECT * FROM subject", ())
+            topics = await self.execute_query("SELECT * FROM topics", ())
+            error = subjects.get("error") or topics.get("error")
+            if error:
+                print(f"⚠️ Failed to load the subject/topic hierarchy: {error}")
+                return False
+
+            subjects_by_category, subject_ids = {}, {}
+            for row in subjects.get("data", []):
+                subjects_by_category.setdefault(str(row["categoryId"]), []).append(row)
+                subject_ids.setdefault((str(row["categoryId"]), name_key(row["subjectName"])), row["id"])
+            topics_by_subject, topic_ids = {}, {}
+            for row in topics.get("data", []):
+                topics_by_subject.setdefault(str(row["subjectId"]), []).append(row)
+                topic_ids.setdefault((str(row["subjectId"]), name_key(row["topicName"])), row["id"])
+
+            self.subjects_by_category, self.subject_ids = subjects_by_category, subject_ids
+            self.topics_by_subject, self.topic_ids = topics_by_subject, topic_ids
+            self.loaded_at = time.monotonic()
+            self.stats["loads"] += 1
+            return True
+
+    async def _lookup(self, index, key):
+        if await self._load():
+            found = getattr(self, index).get(key)
+            if found is not None:
+                self.stats["hits"] += 1
+                return found
+        self.stats["misses"] += 1
+        return None
+
+    async def subject_id(self, category_id, subject_name):
+        found = await self._lookup("subject_ids", (str(category_id), name_key(subject_name)))
+        return found if found is not None else await super().subject_id(category_id, subject_name)
+
+    async def topic_id(self, subject_id, topic_name):
+        found = await self._lookup("topic_ids", (str(subject_id), name_key(topic_name)))
+        return found if found is not None else await super().topic_id(subject_id, topic_name)
+
+    async def subjects(self, category_id):
+        if not await self._load():
+            return await super().subjects(category_id)
+        self.stats["hits"] += 1
+        return list(self.subjects_by_category.get(str(category_id), []))
+
+    async def topics(self, subject_id):
+        if not await self._load():
+            return await super().topics(subject_id)
+        self.stats["hits"] += 1
+        return list(self.topics_by_subject.get(str(subject_id), []))
+
+    def invalidate(self):
+        """Drop the loaded tables; the next lookup reloads them."""
+        self.loaded_at = None
+        self.stats["invalidations"] += 1
+
+    def describe(self):
+        return {
+            **self.stats,
+            "cached": True,
+            "ttl": self.ttl,
+            "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+            "subjects": len(self.subject_ids),
+            "topics": len(self.topic_ids),
+        }
+
+
+def get_hierarchy(execute_query, ttl=None):
+    """Cached hierarchy lookups, or direct queries when HIERARCHY_CACHE_TTL is 0."""
+    ttl = HIERARCHY_CACHE_TTL if ttl is None else ttl
+    if ttl <= 0:
+        return DirectHierarchy(execute_query)
+    return CachedHierarchy(execute_query, ttl)
@@ -3,24 +3,50 @@ import os
 import asyncio
 import logging
 import uuid
+import time
+import tempfile
+import hashlib
+import heapq
 import httpx
-from quart import Quart, request, jsonify
+from quart import Quart, request, jsonify, make_response, send_file
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from quart_cors import cors
 from q_generation_func import (
-    extract_pdf_text,
-    sliding_window_chunks,
-    is_clinically_relevant,
-    generate_mcqs_with_assistant,
+    stream_pdf_chunks,
+    shutdown_pdf_pool,
+    generate_mcqs,
+    MCQ_RUN_MAX_WAIT,
     deduplicate_mcqs,
-    mcqs_to_excel
+    export_mcqs,
+    MCQ_EXPORT_FORMATS,
+)
+from generation_backends import get_generation_backend, NonTextReply
+from write_behind import WriteBehindBuffer, flush_all_buffers
+from task_registry import TaskRegistry, HydrationCache, FINISHED_STATUSES, TASK_RETENTION_SECONDS
+from task_store import get_task_store, TASK_SYNC_INTERVAL
+from explanation_cache import get_explanation_cache, explanation_cache_key
+from artifact_store import get_artifact_store, ARTIFACT_REPLICATION, ARTIFACT_RETENTION_SECONDS
+from mcq_result_cache import get_mcq_result_cache, mcq_result_key
+from clinical_relevance import get_relevance_checker, get_chunk_gate
+from hierarchy_cache import get_hierarchy
+from batch_jobs import (
+    BATCH_BACKEND,
+    BATCH_JOB_FOLDER,
+    BATCH_MAX_REQUESTS,
+    build_request_line,
+    write_request_file,
+    read_result_file,
+    remove_job_files,
+    get_batch_backend
 )
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio import multipart
 import cloudinary
 import cloudinary.uploader
-from io import BytesIO
 import sys
 import aiomysql
 import pymysql
@@ -35,6 +61,14 @@ logging.basicConfig(level=logging.INFO)
 API_KEY = os.getenv("OPENAI_API_KEY")
 EX_ASSISTANT_ID = os.getenv("EX_ASSISTANT_ID")
 GEN_ASSISTANT_ID = os.getenv("GEN_ASSISTANT_ID")
+# Upper bound on simultaneous HTTP connections shared by every OpenAI call
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+# Model for offline batch jobs; defaults to the explanation assistant's own model
+EXPLANATION_BATCH_MODEL = os.getenv("EXPLANATION_BATCH_MODEL")
+
+# How often progress streams check their task for changes, and the idle keep-alive period
+PROGRESS_STREAM_INTERVAL = float(os.getenv("PROGRESS_STREAM_INTERVAL", "0.5"))
+PROGRESS_HEARTBEAT_SECONDS = 15
 
 # MySQL Configuration
 MYSQL_HOST = os.getenv("MYSQL_HOST", "tramway.proxy.rlwy.net")
@@ -49,13 +83,30 @@ if not API_KEY or not EX_ASSISTANT_ID or not GEN_ASSISTANT_ID:
 if not MYSQL_PASSWORD:
     raise ValueError("Missing MySQL credentials.")
 
-client = OpenAI(api_key=API_KEY)
+# One async client (and one HTTP connection pool) for every OpenAI call in the app
+client = AsyncOpenAI(
+    api_key=API_KEY,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    ),
+)
 app = Quart(__name__)
 app = cors(app, allow_origin="*")
 
-task_status = {}
+# Task entries keep compact result records; question details and saved explanations
+# are read back from the database by hydrate_results when a status is requested.
+# Question text and options of settled records are kept between polls until the task is evicted.
+hydration_cache = HydrationCache()
+task_status = TaskRegistry(on_remove=hydration_cache.forget)
 running_tasks = {}
 
+# Explanations for identical prompts are reused across questions and tasks (None when disabled)
+explanation_cache = get_explanation_cache()
+
 # Database connection pool
 db_pool = None
 
@@ -118,6 +169,171 @@ async def execute_query(query, params=None):
                 return {"error": str(e)}
 
 
+# Shared task state across workers (None when TASK_STORE=memory)
+task_store = get_task_store(execute_query)
+# Subject and topic lookups, served from memory for HIERARCHY_CACHE_TTL seconds
+hierarchy = get_hierarchy(execute_query)
+
+
+async def bulk_update_descriptions(pairs, chunk_size=200):
+    """Write ``(questionId, description)`` pairs with one multi-row UPDATE per chunk.
+
+    Returns the set of question ids whose chunk could not be written.
+    """
+    failed = set()
+    for chunk in batchify(pairs, size=chunk_size):
+        cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        ids_placeholders = ",".join(["%s"] * len(chunk))
+        query = f"UPDATE tblquestion SET description = CASE questionId {cases} END WHERE questionId IN ({ids_placeholders})"
+        params = [value for qid, text in chunk for value in (qid, text)] + [qid for qid, _ in chunk]
+
+        response = await execute_query(query, params)
+        if response.get("error"):
+            # Retry the chunk row by row so one bad row does not fail its neighbours
+            for qid, text in chunk:
+                single = await execute_query("UPDATE tblquestion SET description = %s WHERE questionId = %s", (text, qid))
+                if single.get("error"):
+                    failed.add(qid)
+    return failed
+
+
+# Description filters used when loading questions that still need an explanation
+BLANK_DESCRIPTION = "(q.description IS NULL OR TRIM(q.description) = '')"
+NULL_DESCRIPTION = "q.description IS NULL"
+
+
+def group_question_rows(rows):
+    """Group joined question/option rows into per-question bundles in a single pass.
+
+    Each bundle holds the question columns plus an ``options`` list of
+    ``{"questionImageText", "isCorrectAnswer"}`` dicts in database order.
+    """
+    bundles = {}
+    for row in rows:
+        option_text = row.pop("optionText", None)
+        option_correct = row.pop("optionIsCorrect", None)
+        bundle = bundles.get(row["questionId"])
+        if bundle is None:
+            bundle = bundles[row["questionId"]] = {**row, "options": []}
+        if option_text is not None or option_correct is not None:
+            bundle["options"].append({"questionImageText": option_text, "isCorrectAnswer": option_correct})
+    return list(bundles.values())
+
+
+def _bundle_columns(full_rows):
+    question_columns = "q.*" if full_rows else "q.questionId, q.question"
+    return f"{question_columns}, o.questionImageText AS optionText, o.isCorrectAnswer AS optionIsCorrect"
+
+
+async def load_topic_bundles(topic_id, description_filter=None, full_rows=False):
+    """Load every question linked to ``topic_id`` together with its options in one query."""
+    query = f"""
+        SELECT {_bundle_columns(full_rows)}
+        FROM (SELECT DISTINCT questionId FROM topicQueRel WHERE topicId = %s) rel
+        JOIN tblquestion q ON q.questionId = rel.questionId
+        LEFT JOIN tblquestionoption o ON o.questionId = q.questionId
+        {"WHERE " + description_filter if description_filter else ""}
+    """
+    response = await execute_query(query, (topic_id,))
+    if response.get("error"):
+        raise Exception("Failed to load questions")
+    return group_question_rows(response.get("data", []))
+
+
+async def load_pending_bundle_page(after_id, limit, description_filter=NULL_DESCRIPTION):
+    """Keyset page of questions matching ``description_filter`` with ``questionId > after_id``."""
+    query = f"""
+        SELECT {_bundle_columns(False)}
+        FROM (
+            SELECT q.questionId FROM tblquestion q
+            WHERE {description_filter} AND q.questionId > %s
+            ORDER BY q.questionId LIMIT %s
+        ) page
+        JOIN tblquestion q ON q.questionId = page.questionId
+        LEFT JOIN tblquestionoption o ON o.questionId = q.questionId
+    """
+    response = await execute_query(query, (after_id, limit))
+    if response.get("error"):
+        raise Exception("Failed to load questions")
+    return sorted(group_question_rows(response.get("data", [])), key=lambda b: b["questionId"])
+
+
+async def load_bundles_by_ids(question_ids, chunk_size=500):
+    """Question bundles, including the stored description, for explicit question ids."""
+    bundles = {}
+    for chunk in batchify(list(question_ids), size=chunk_size):
+        ids_placeholders = ",".join(["%s"] * len(chunk))
+        query = f"""
+            SELECT q.questionId, q.question, q.description, o.questionImageText AS optionText, o.isCorrectAnswer AS optionIsCorrect
+            FROM tblquestion q
+            LEFT JOIN tblquestionoption o ON o.questionId = q.questionId
+            WHERE q.questionId IN ({ids_placeholders})
+        """
+        response = await execute_query(query, chunk)
+        if response.get("error"):
+            raise Exception("Failed to load questions")
+        for bundle in group_question_rows(response.get("data", [])):
+            bundles[bundle["questionId"]] = bundle
+    return bundles
+
+
+async def load_descriptions_by_ids(question_ids, chunk_size=500):
+    """Stored ``description`` per question id, without the options."""
+    descriptions = {}
+    for chunk in batchify(list(question_ids), size=chunk_size):
+        ids_placeholders = ",".join(["%s"] * len(chunk))
+        query = f"SELECT questionId, description FROM tblquestion WHERE questionId IN ({ids_placeholders})"
+        response = await execute_query(query, chunk)
+        if response.get("error"):
+            raise Exception("Failed to load explanations")
+        for row in response.get("data", []):
+            descriptions[row["questionId"]] = row["description"]
+    return descriptions
+
+
+def drop_saved_explanation(record):
+    """Once an explanation is in the database the task record only keeps a reference to it."""
+    record.pop("explanation", None)
+
+
+async def hydrate_results(results, task_id=None):
+    """Expand compact task result records with question, options, correct answer and explanation.
+
+    With ``task_id``, question text and options of records whose DB write has settled
+    come from ``hydration_cache``; only their saved explanations are read back.
+    """
+    ids = {r["questionId"] for r in results if "error" not in r or "explanation" in r}
+    if not ids:
+        return list(results)
+
+    bundles = hydration_cache.get(task_id, ids) if task_id is not None else {}
+    cached = set(bundles)
+    missing = ids - cached
+    if missing:
+        loaded = await load_bundles_by_ids(missing)
+        bundles.update(loaded)
+        if task_id is not None:
+            settled = {r["questionId"] for r in results if r.get("writeStatus") != "pending"}
+            hydration_cache.put(task_id, {qid: loaded[qid] for qid in missing & settled & loaded.keys()})
+    unexplained = {r["questionId"] for r in results if r["questionId"] in cached and "explanation" not in r}
+    descriptions = await load_descriptions_by_ids(unexplained) if unexplained else {}
+    hydrated = []
+    for record in results:
+        bundle = bundles.get(record["questionId"])
+        if bundle is None or record["questionId"] not in ids:
+            hydrated.append(record)
+            continue
+        correct = next((opt for opt in bundle["options"] if opt["isCorrectAnswer"] == "1"), None)
+        hydrated.append({
+            **record,
+            "question": bundle["question"],
+            "options": [opt["questionImageText"] for opt in bundle["options"]],
+            "correctAnswer": correct["questionImageText"] if correct else None,
+            "explanation": record.get("explanation", descriptions.get(record["questionId"], bundle.get("description"))),
+        })
+    return hydrated
+
+
 @app.route("/get-remaining-question-count", methods=["POST"])
 async def get_remaining_question_count():
     data = await request.get_json()
@@ -128,20 +344,14 @@ async def get_remaining_question_count():
     print(category_id, subject_name, topic_name)
 
     # Get subject ID
-    query_subject = "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s"
-    subject_resp = await execute_query(query_subject, (category_id, subject_name))
-    subject_data = subject_resp.get("data", [])
-    if not subject_data:
+    subject_id = await hierarchy.subject_id(category_id, subject_name)
+    if subject_id is None:
         return jsonify({"count": 0})
-    subject_id = subject_data[0]["id"]
 
     # Get topic ID
-    query_topic = "SELECT id FROM topics WHERE subjectId = %s AND topicName = %s"
-    topic_resp = await execute_query(query_topic, (subject_id, topic_name))
-    topic_data = topic_resp.get("data", [])
-    if not topic_data:
+    topic_id = await hierarchy.topic_id(subject_id, topic_name)
+    if topic_id is None:
         return jsonify({"count": 0})
-    topic_id = topic_data[0]["id"]
 
     # Get question IDs
     query_ids = "SELECT questionId FROM topicQueRel WHERE topicId = %s"
@@ -174,33 +384,218 @@ async def generate_category_questions():
         print(f"[INIT TASK] categoryId={category_id}, subject={subject_name}, topic={topic_name}", flush=True)
 
         task_id = str(uuid.uuid4())
-        task_status[task_id] = {"status": "started", "progress": 0, "results": [], "error": None}
+        task_status[task_id] = {
+            "status": "started", "progress": 0, "results": [], "error": None, "startedAt": time.time()
+        }
 
         task = asyncio.create_task(process_question_generation(task_id, category_id, subject_name, topic_name))
         running_tasks[task_id] = task
+        task.add_done_callback(lambda _: running_tasks.pop(task_id, None))
+        await publish_new_task(task_id, "explanation")
 
         return jsonify({"status": "started", "taskId": task_id})
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
+async def load_task_entry(task_id, registry, kind, start=0):
+    """The task's entry from this worker, or from the shared task store if another worker owns it.
+
+    Stored entries only carry the result records from ``start`` on.
+    """
+    entry = registry.get(task_id)
+    if entry is None and task_store:
+        entry = await task_store.load(task_id, kind, start)
+    return entry
+
+
+def settled_count(results, start=0):
+    """Index of the first record at or after ``start`` still waiting on a buffered DB write."""
+    settled = min(start, len(results))
+    while settled < len(results) and results[settled].get("writeStatus") != "pending":
+        settled += 1
+    return settled
+
+
+def task_counters(entry):
+    """Summary counters for a task entry; ``throughput`` is results per second while it runs."""
+    results = entry.get("results") or []
+    done = len(results)
+    total = entry.get("total")
+    elapsed = time.time() - entry["startedAt"] if entry.get("startedAt") else None
+    running = entry.get("status") not in FINISHED_STATUSES
+    # Entries loaded from the task store only hold part of their records, but carry the failed count
+    failed = entry["failedResults"] if "failedResults" in entry else sum(1 for record in results if "error" in record)
+    return {
+        "done": done,
+        "failed": failed,
+        "remaining": max(total - done, 0) if total is not None else None,
+        "throughput": round(done / elapsed, 3) if running and elapsed else None,
+    }
+
+
+async def task_status_payload(entry, hydrate=None):
+    """Status response for ``entry``. With ``?cursor=N`` only settled records from index N
+    on are included, and ``cursor`` in the response is the value to send next time."""
+    response = dict(entry)
+    response["counters"] = task_counters(entry)
+    results = entry.get("results")
+    if results is None:
+        return response
+
+    if request.args.get("cursor") is not None:
+        start = int(request.args["cursor"])
+        if start < 0:
+            raise ValueError("cursor must be a non-negative integer")
+        end = settled_count(results, start)
+        results = results[min(start, end):end]
+        response["cursor"] = end
+
+    response["results"] = await hydrate(results) if hydrate and results else list(results)
+    return response
+
+
+def sse_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def requested_cursor():
+    """``?cursor=`` as a non-negative int, 0 when absent or invalid (the payload reports invalid values)."""
+    try:
+        return max(0, int(request.args.get("cursor", 0)))
+    except ValueError:
+        return 0
+
+
+def int_field(value, default, minimum):
+    """A request field as an int no lower than ``minimum``, ``default`` when missing or empty.
+
+    Raises ``ValueError`` when the value is not a whole number.
+    """
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{value!r} is not an integer")
+    try:
+        return max(minimum, int(value))
+    except TypeError:
+        raise ValueError(f"{value!r} is not an integer")
+
+
+def stream_cursor():
+    """Result index a progress stream starts from: ``Last-Event-ID`` on reconnect, else ``?cursor=``."""
+    try:
+        return max(0, int(request.headers.get("Last-Event-ID") or request.args.get("cursor", 0)))
+    except ValueError:
+        return 0
+
+
+async def task_progress_events(task_id, registry, running, kind, cursor=0):
+    """Server-sent events for one task.
+
+    ``status`` carries the entry without its results whenever it changes, ``results``
+    carries the records appended since the last one (``id`` is the next cursor), and
+    ``end`` is sent once the task has finished and every record was delivered. Records
+    still waiting on a buffered DB write are held back until it settles.
+    """
+    last_state = None
+    last_sent = time.monotonic()
+    while True:
+        entry = await load_task_entry(task_id, registry, kind, cursor)
+        if entry is None:
+            yield sse_event("end", {"status": "not_found"})
+            return
+
+        state = {key: value for key, value in entry.items() if key not in ("results", "resultCount", "failedResults")}
+        results = entry.get("results") or []
+        settled = settled_count(results, cursor)
+
+        # Compare serialized snapshots: nested objects (cache, dedup, chunkGate, ...) are mutated in place
+        serialized = json.dumps(state, sort_keys=True, default=str)
+        if serialized != last_state:
+            last_state = serialized
+            last_sent = time.monotonic()
+            yield sse_event("status", state)
+
+        if settled > cursor:
+            batch = results[cursor:settled]
+            if kind == "explanation":
+                batch = await hydrate_results(batch, task_id)
+            last_sent = time.monotonic()
+            yield sse_event("results", {"start": cursor, "results": batch}, event_id=settled)
+            cursor = settled
+
+        if state.get("status") in FINISHED_STATUSES and task_id not in running and cursor >= len(results):
+            yield sse_event("end", {"status": state.get("status")})
+            return
+
+        if time.monotonic() - last_sent > PROGRESS_HEARTBEAT_SECONDS:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(PROGRESS_STREAM_INTERVAL)
+
+
+async def progress_stream_response(task_id, registry, running, kind):
+    if await load_task_entry(task_id, registry, kind) is None:
+        return jsonify({"status": "not_found"}), 404
+    response = await make_response(
+        task_progress_events(task_id, registry, running, kind, stream_cursor()),
+        {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.timeout = None
+    return response
+
+
 @app.route("/task-status/<task_id>", methods=["GET"])
 async def task_status_check(task_id):
-    task = task_status.get(task_id)
+    task = await load_task_entry(task_id, task_status, "explanation", requested_cursor())
     if not task:
         return jsonify({"status": "not_found"}), 404
-    return jsonify(task)
+    try:
+        return jsonify(await task_status_payload(task, lambda results: hydrate_results(results, task_id)))
+    except ValueError:
+        return jsonify({"status": "error", "error": "cursor must be a non-negative integer"}), 400
 
 
-@app.route("/cancel-task/<task_id>", methods=["POST", "GET"])
-async def cancel_task(task_id):
-    task = running_tasks.get(task_id)
+# Push alternative to polling /task-status: only new results and state changes are sent
+@app.route("/task-progress/<task_id>", methods=["GET"])
+async def task_progress_stream(task_id):
+    return await progress_stream_response(task_id, task_status, running_tasks, "explanation")
+
+
+@app.route("/task-registry-stats", methods=["GET"])
+async def task_registry_stats():
+    return jsonify({
+        "explanations": task_status.stats(),
+        "mcq": mcq_tasks.stats(),
+        "explanationCache": explanation_cache.describe() if explanation_cache else None,
+        "mcqResultCache": mcq_result_cache.describe() if mcq_result_cache else None,
+        "relevance": relevance_checker.describe(),
+        "hierarchyCache": hierarchy.describe(),
+        "hydrationCache": hydration_cache.stats(),
+    })
+
+
+def cancel_local_task(task_id, registry, running):
+    task = running.get(task_id)
     if task and not task.done():
         task.cancel()
         print(f"[CANCEL] Task {task_id} was cancelled by user.", flush=True)
-    task_status[task_id]["status"] = "cancelled"
-    task_status[task_id]["error"] = "Cancelled by user."
-    running_tasks.pop(task_id, None)
+    registry[task_id]["status"] = "cancelled"
+    registry[task_id]["error"] = "Cancelled by user."
+    running.pop(task_id, None)
+
+
+@app.route("/cancel-task/<task_id>", methods=["POST", "GET"])
+async def cancel_task(task_id):
+    if task_id in task_status:
+        cancel_local_task(task_id, task_status, running_tasks)
+    elif not (task_store and await task_store.request_cancel(task_id)):
+        return jsonify({"status": "not_found"}), 404
     return "", 200
 
 
@@ -209,50 +604,255 @@ SETUP_TIMEOUT = 10
 DB_TIMEOUT = 10
 MAX_WAIT_SECONDS = 120
 
+# Number of questions kept in flight at once by the explanation jobs
+EXPLANATION_CONCURRENCY = max(1, int(os.getenv("EXPLANATION_CONCURRENCY", "8")))
+# Questions loaded per keyset page by the global backfill jobs
+QUESTION_PAGE_SIZE = 200
+# Questions packed into one assistant request by the backfill jobs (1 disables batching)
+EXPLANATION_BATCH_SIZE = max(1, int(os.getenv("EXPLANATION_BATCH_SIZE", "1")))
+
+OPTION_LABELS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
-async def safe_to_thread(func, *args, timeout=SETUP_TIMEOUT, **kwargs):
+
+async def safe_await(coro, timeout=SETUP_TIMEOUT):
+    """Await an OpenAI call, cancelling the underlying request if it exceeds ``timeout``."""
     try:
-        return await asyncio.wait_for(
-            asyncio.to_thread(func, *args, **kwargs),
-            timeout=timeout
-        )
+        return await asyncio.wait_for(coro, timeout=timeout)
     except asyncio.TimeoutError:
-        print("⚠️ Timeout in to_thread call, skipping...")
+        print("⚠️ Timeout in OpenAI call, skipping...")
         return None
 
 
+async def run_question_pool(task_id, jobs, worker, concurrency=EXPLANATION_CONCURRENCY):
+    """Run ``worker(index, job)`` for every ``(index, job)`` pair with bounded concurrency.
+
+    Workers return the result record for their question, or a list of records when a
+    job covers several consecutive indexes (batched explanations). Records are appended to
+    ``task_status[task_id]["results"]`` strictly in index order, and ``progress`` only
+    advances past an index once every earlier question has finished.
+    """
+    if not jobs:
+        return
+
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    finished = {}
+    next_index = jobs[0][0]
+
+    def publish(record):
+        nonlocal next_index
+        finished[record["index"]] = record
+        while next_index in finished:
+            task_status[task_id]["results"].append(finished.pop(next_index))
+            task_status[task_id]["progress"] = next_index
+            next_index += 1
+
+    async def worker_loop():
+        while True:
+            try:
+                index, job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if task_id not in running_tasks:
+                raise asyncio.CancelledError()
+            result = await worker(index, job)
+            for record in result if isinstance(result, list) else [result]:
+                publish(record)
+
+    workers = [asyncio.create_task(worker_loop()) for _ in range(min(concurrency, len(jobs)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+
+# Backends are chosen per pipeline with EXPLANATION_BACKEND / MCQ_BACKEND (see generation_backends.py)
+explanation_backend = get_generation_backend(client, "explanation", EX_ASSISTANT_ID, MAX_WAIT_SECONDS)
+mcq_backend = get_generation_backend(client, "mcq", GEN_ASSISTANT_ID, MCQ_RUN_MAX_WAIT)
+
+
+async def request_explanation(task_id, prompt):
+    """Generate a reply to ``prompt`` on the explanation backend and return its text.
+
+    Raises ``NonTextReply`` when the model answers with something other than text.
+    """
+    return await explanation_backend.generate(prompt, should_cancel=lambda: task_id not in running_tasks)
+
+
+def format_question_block(question, q_opts):
+    """Build the ``Question / Options / Correct Answer`` block used in explanation prompts."""
+    labeled_opts = []
+    correct_label = ""
+    for i, opt in enumerate(q_opts):
+        label = OPTION_LABELS[i]
+        labeled_opts.append(f"{label}. {opt['questionImageText']}")
+        if opt["isCorrectAnswer"] == "1":
+            correct_label = label
+
+    return (
+            f"Question: {question}\nOptions:\n" +
+            "\n".join(labeled_opts) +
+            f"\nCorrect Answer: {correct_label}"
+    )
+
+
+def parse_explanation(text):
+    """Return the ``explanation`` field of a JSON reply, or the raw text if it is not JSON."""
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, dict):
+            return parsed.get("explanation", text)
+    except Exception:
+        pass
+    return text
+
+
+async def request_batch_explanations(task_id, blocks, preamble=""):
+    """Explain several questions with one assistant run.
+
+    ``blocks`` maps a question key to its question block. Returns a dict with an
+    explanation for every key the assistant answered; keys that are missing or
+    unparseable are simply left out so the caller can retry them one by one.
+    """
+    prompt = (
+            (preamble + "\n" if preamble else "") +
+            "For each of the following questions, explain why the correct option is right.\n"
+            "Reply with a single JSON object that maps each question key to its explanation, "
+            'for example {"Q1": "...", "Q2": "..."}. Do not add any other text.\n\n' +
+            "\n\n".join(f"[{key}]\n{block}" for key, block in blocks.items())
+    )
+
+    text = await request_explanation(task_id, prompt)
+    # Tolerate code fences or stray prose around the JSON object
+    parsed = json.loads(text[text.find("{"):text.rfind("}") + 1])
+
+    explanations = {}
+    for key in blocks:
+        value = parsed.get(key)
+        if isinstance(value, dict):
+            value = value.get("explanation")
+        if isinstance(value, str) and value.strip():
+            explanations[key] = value.strip()
+    return explanations
+
+
+async def explain_batch(task_id, batch, explain, question_block, preamble=""):
+    """Explain ``batch`` (a list of ``(index, question)``) with one request per batch.
+
+    ``question_block(q)`` builds the block for one question and ``explain(index, q,
+    explanation)`` stores an explanation and returns the result record; called with
+    ``explanation=None`` it generates the explanation on its own, which is how items
+    the batched reply did not cover are retried.
+    """
+    blocks = {}
+    for index, q in batch:
+        if "cachedExplanation" in q:
+            continue  # answered from the explanation cache
+        try:
+            blocks[f"Q{q['questionId']}"] = question_block(q)
+        except Exception:
+            pass  # the single-question path records the error
+
+    explanations = {}
+    if len(blocks) > 1:
+        try:
+            explanations = await request_batch_explanations(task_id, blocks, preamble)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Batched explanation failed, retrying {len(blocks)} question(s) one by one: {e}")
+
+    if blocks and len(explanations) < len(blocks):
+        print(f"🔁 Batch answered {len(explanations)}/{len(blocks)} question(s), retrying the rest individually")
+
+    return [await explain(index, q, explanations.get(f"Q{q['questionId']}")) for index, q in batch]
+
+
+def explanation_jobs(questions, start, batch_size):
+    """Pair questions with their indexes and group them into pool jobs of ``batch_size``."""
+    jobs = list(enumerate(questions, start=start))
+    if batch_size <= 1:
+        return jobs
+    return [(batch[0][0], batch) for batch in batchify(jobs, size=batch_size)]
+
+
+def explanation_worker(task_id, explain, question_block, batch_size, preamble=""):
+    """Pool worker matching ``explanation_jobs``: ``explain`` itself, or a batched wrapper around it."""
+    if batch_size <= 1:
+        return explain
+
+    async def explain_jobs(_, batch):
+        return await explain_batch(task_id, batch, explain, question_block, preamble)
+
+    return explain_jobs
+
+
+async def attach_cached_explanations(task_id, questions, question_block, preamble=""):
+    """Look every question up in the explanation cache before any assistant call.
+
+    Each question gets its cache key as ``q["cacheKey"]`` and, on a hit, the stored text
+    as ``q["cachedExplanation"]``. Hits and misses accumulate in the task's ``cache`` entry.
+    """
+    if not explanation_cache:
+        return
+    keyed = []
+    for q in questions:
+        try:
+            q["cacheKey"] = explanation_cache_key(question_block(q), preamble)
+            keyed.append(q)
+        except Exception:
+            pass  # the pipeline's own checks record the error
+
+    try:
+        hits = await explanation_cache.get_many([q["cacheKey"] for q in keyed])
+    except Exception as e:
+        print(f"⚠️ Explanation cache lookup failed: {e}")
+        hits = {}
+    for q in keyed:
+        if q["cacheKey"] in hits:
+            q["cachedExplanation"] = hits[q["cacheKey"]]
+
+    found = sum(1 for q in keyed if "cachedExplanation" in q)
+    counts = task_status[task_id].setdefault("cache", {"hits": 0, "misses": 0})
+    counts["hits"] += found
+    counts["misses"] += len(keyed) - found
+
+
+async def remember_explanations(pairs):
+    """Cache ``(question, explanation)`` pairs for questions that carry a cache key."""
+    items = [(q["cacheKey"], text) for q, text in pairs if q.get("cacheKey")]
+    if not (explanation_cache and items):
+        return
+    try:
+        await explanation_cache.put_many(items)
+    except Exception as e:
+        print(f"⚠️ Failed to cache {len(items)} explanation(s): {e}")
+
+
 async def process_question_generation(task_id, category_id, subject_name, topic_name):
     try:
         # Get subject ID
-        query_subject = "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s"
-        subject = await execute_query(query_subject, (category_id, subject_name))
-        if not subject.get("data"):
+        subject_id = await hierarchy.subject_id(category_id, subject_name)
+        if subject_id is None:
             raise Exception("Subject not found")
-        subject_id = subject.get("data", [])[0]["id"]
 
         # Get topic ID
-        query_topic = "SELECT id FROM topics WHERE subjectId = %s AND topicName = %s"
-        topic = await execute_query(query_topic, (subject_id, topic_name))
-        if not topic.get("data"):
+        topic_id = await hierarchy.topic_id(subject_id, topic_name)
+        if topic_id is None:
             raise Exception("Topic not found")
-        topic_id = topic.get("data", [])[0]["id"]
-
-        # Get question IDs
-        query_ids = "SELECT questionId FROM topicQueRel WHERE topicId = %s"
-        ids_resp = await execute_query(query_ids, (topic_id,))
-        question_data = ids_resp.get("data", [])
-        if not isinstance(question_data, list) or not question_data:
-            raise Exception("No questions found")
-        question_ids = [str(row["questionId"]) for row in question_data]
 
-        # Get questions
-        ids_placeholders = ",".join(["%s"] * len(question_ids))
-        query_questions = f"SELECT questionId, question, description FROM tblquestion WHERE questionId IN ({ids_placeholders}) AND (description IS NULL OR TRIM(description) = '')"
-
-        questions_resp = await execute_query(query_questions, question_ids)
-        questions = questions_resp.get("data", [])
+        # Get unexplained questions together with their options
+        questions = await load_topic_bundles(topic_id, BLANK_DESCRIPTION)
 
         if not questions:
+            linked = await execute_query("SELECT 1 AS linked FROM topicQueRel WHERE topicId = %s LIMIT 1", (topic_id,))
+            if not linked.get("data"):
+                raise Exception("No questions found")
             task_status[task_id] = {
                 "status": "completed",
                 "progress": 0,
@@ -261,106 +861,26 @@ async def process_question_generation(task_id, category_id, subject_name, topic_
             }
             return
 
-        # Get options
-        query_options = f"SELECT questionId, questionImageText, isCorrectAnswer FROM tblquestionoption WHERE questionId IN ({ids_placeholders})"
-        options_resp = await execute_query(query_options, question_ids)
-        options = options_resp.get("data", [])
-
-        label_map = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        task_status[task_id]["total"] = len(questions)
+        writer = WriteBehindBuffer(bulk_update_descriptions, on_saved=drop_saved_explanation)
 
-        for idx, q in enumerate(questions, start=1):
+        async def explain(idx, q):
             try:
-                if task_id not in running_tasks:
-                    raise asyncio.CancelledError()
-
-                await asyncio.sleep(0)  # yield control
-
-                q_opts = [opt for opt in options if opt["questionId"] == q["questionId"]]
-                correct = next((opt for opt in q_opts if opt["isCorrectAnswer"] == "1"), None)
-
-                labeled_opts = []
-                correct_label = ""
-                for i, opt in enumerate(q_opts):
-                    label = label_map[i]
-                    labeled_opts.append(f"{label}. {opt['questionImageText']}")
-                    if opt["isCorrectAnswer"] == "1":
-                        correct_label = label
-
-                prompt = (
-                        f"Question: {q['question']}\nOptions:\n" +
-                        "\n".join(labeled_opts) +
-                        f"\nCorrect Answer: {correct_label}\n\nExplain why the correct option is right."
-                )
-
-                thread = await safe_to_thread(
-                    client.beta.threads.create,
-                    messages=[{"role": "user", "content": prompt}],
-                    timeout=SETUP_TIMEOUT
-                )
-                if thread is None:
-                    raise Exception("Failed to create thread")
-
-                run = await safe_to_thread(
-                    client.beta.threads.runs.create,
-                    thread_id=thread.id,
-                    assistant_id=EX_ASSISTANT_ID,
-                    timeout=SETUP_TIMEOUT
-                )
-                if run is None:
-                    raise Exception("Failed to start run")
-
-                for wait_count in range(MAX_WAIT_SECONDS):
-                    if task_id not in running_tasks:
-                        print(f"[MCQ TASK] {task_id} - Detected cancellation during wait.")
-                        raise asyncio.CancelledError()
-
-                    run = await safe_to_thread(
-                        client.beta.threads.runs.retrieve,
-                        thread_id=thread.id,
-                        run_id=run.id,
-                        timeout=SETUP_TIMEOUT
-                    )
-                    if run is None:
-                        continue  # skip this loop if timeout
-
-                    if run.status == "completed":
-                        break
-
-                    await asyncio.sleep(1)
+                q_opts = q["options"]
+                cached = "cachedExplanation" in q
+                if cached:
+                    final_explanation = q["cachedExplanation"]
                 else:
-                    raise Exception(f"Timeout waiting for assistant response on question {idx}")
+                    prompt = format_question_block(q['question'], q_opts) + "\n\nExplain why the correct option is right."
 
-                messages = await safe_to_thread(
-                    client.beta.threads.messages.list,
-                    thread_id=thread.id,
-                    timeout=SETUP_TIMEOUT
-                )
-                if messages is None or not messages.data:
-                    raise Exception("Failed to retrieve messages")
+                    final_explanation = parse_explanation(await request_explanation(task_id, prompt))
+                    await remember_explanations([(q, final_explanation)])
 
-                explanation = messages.data[0].content[0].text.value
-                try:
-                    explanation_json = json.loads(explanation)
-                    final_explanation = explanation_json.get("explanation", explanation)
-                except Exception:
-                    final_explanation = explanation
-
-                update_query = "UPDATE tblquestion SET description = %s WHERE questionId = %s"
-                response = await execute_query(update_query, (final_explanation, int(q['questionId'])))
-
-                if response.get("error"):
-                    raise Exception("DB update failed")
-
-                task_status[task_id]["results"].append({
-                    "index": idx,
-                    "questionId": q["questionId"],
-                    "question": q.get("question", ""),
-                    "options": [opt.get("questionImageText", "") for opt in q_opts],
-                    "correctAnswer": correct["questionImageText"] if correct else None,
-                    "explanation": final_explanation
-                })
-
-                task_status[task_id]["progress"] = idx
+                record = {"index": idx, "questionId": q["questionId"], "explanation": final_explanation}
+                if cached:
+                    record["cached"] = True
+                await writer.add(int(q['questionId']), final_explanation, record)
+                return record
 
             except asyncio.CancelledError:
                 print(f"❌ [ABORTED] Task {task_id} cancelled during question {idx}.")
@@ -368,11 +888,19 @@ async def process_question_generation(task_id, category_id, subject_name, topic_
 
             except Exception as inner_e:
                 print(f"🔥 [ERROR] Question {idx} failed {inner_e}")
-                task_status[task_id]["results"].append({
+                return {
                     "index": idx,
                     "questionId": q["questionId"],
                     "error": str(inner_e)
-                })
+                }
+
+        try:
+            await attach_cached_explanations(
+                task_id, questions, lambda q: format_question_block(q['question'], q['options'])
+            )
+            await run_question_pool(task_id, list(enumerate(questions, start=1)), explain)
+        finally:
+            await writer.close()
 
         task_status[task_id]["status"] = "completed"
         print(f"🏁 [TASK COMPLETE] All questions processed.")
@@ -395,38 +923,18 @@ async def fetch_questions_by_topic():
         if not topic_id:
             return jsonify({"error": "Missing topicId"}), 400
 
-        # Step 1: Fetch question IDs linked to the topic
-        query_ids = "SELECT questionId FROM topicQueRel WHERE topicId = %s"
-        response_ids = await execute_query(query_ids, (topic_id,))
-
-        if response_ids.get("error"):
-            return jsonify({"error": "Failed to fetch question IDs"}), 500
-
-        id_data = response_ids
-        print("Raw topic-question ID data:", id_data)
+        # Fetch the topic's questions with their options in one query
+        try:
+            questions = await load_topic_bundles(topic_id, full_rows=True)
+        except Exception:
+            return jsonify({"error": "Failed to fetch questions"}), 500
 
-        # ✅ Correct extraction of questionId values from response
-        rows = id_data.get("data", [])
-        question_ids = [row["questionId"] for row in rows if row.get("questionId")]
-        print("Extracted question IDs:", question_ids)
+        print(f"Fetched {len(questions)} question(s) for topic {topic_id}")
 
-        if not question_ids:
+        if not questions:
             return jsonify([])
 
-        # Step 2: Build query for full questions
-        ids_placeholders = ",".join(["%s"] * len(question_ids))
-        query_questions = f"SELECT * FROM tblquestion WHERE questionId IN ({ids_placeholders})"
-        print("Final question query:", query_questions)
-
-        response_questions = await execute_query(query_questions, question_ids)
-
-        if response_questions.get("error"):
-            return jsonify({"error": "Failed to fetch questions"}), 500
-
-        questions = response_questions
-        print("Fetched questions:", questions)
-
-        return jsonify(questions)
+        return jsonify({"data": questions})
 
     except Exception as e:
         print("Error:", e)
@@ -442,17 +950,12 @@ async def fetch_subjects():
         if not category_id:
             return jsonify({"error": "Missing categoryId"}), 400
 
-        # Prepare the SQL query
-        sql_query = "SELECT * FROM subject WHERE categoryId = %s"
-
-        # Make database query
-        response = await execute_query(sql_query, (category_id,))
-
-        if response.get("error"):
+        subjects = await hierarchy.subjects(category_id)
+        if subjects is None:
             return jsonify({"error": "Failed to query external DB"}), 500
 
         # Return the response in the same format as before
-        return jsonify(response)
+        return jsonify({"data": subjects})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -467,20 +970,24 @@ async def fetch_topics():
         if not subject_id:
             return jsonify({"error": "Missing subjectId"}), 400
 
-        sql_query = "SELECT * FROM topics WHERE subjectId = %s"
-
-        response = await execute_query(sql_query, (subject_id,))
-
-        if response.get("error"):
+        topics = await hierarchy.topics(subject_id)
+        if topics is None:
             return jsonify({"error": "Failed to query external DB"}), 500
 
         # Return response in the same format as before
-        return jsonify(response)
+        return jsonify({"data": topics})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/invalidate-hierarchy-cache", methods=["POST"])
+async def invalidate_hierarchy_cache():
+    """Reload subjects and topics on the next lookup, e.g. after editing them in the database."""
+    hierarchy.invalidate()
+    return jsonify({"status": "success"})
+
+
 @app.route("/health", methods=["GET"])
 async def health():
     try:
@@ -502,12 +1009,145 @@ async def health():
         return jsonify({"status": "unhealthy", "database": "error", "error": str(e)}), 500
 
 
-mcq_tasks = {}
+mcq_tasks = TaskRegistry()
 
 # ==================================== QUESTION GENERATION
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Largest PDF upload accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Upload bytes being received at once across requests; uploads beyond it are turned away with a 503
+MAX_INFLIGHT_UPLOAD_BYTES = int(os.getenv("MAX_INFLIGHT_UPLOAD_BYTES", str(400 * 1024 * 1024)))
+# Uploaded PDFs older than this are removed at startup (a task removes its own PDF when it finishes)
+UPLOAD_RETENTION_SECONDS = int(os.getenv("UPLOAD_RETENTION_SECONDS", str(6 * 3600)))
+UPLOAD_COPY_CHUNK_BYTES = 1024 * 1024
+# Text form fields sent with an upload are kept in memory up to this many bytes in total
+UPLOAD_FIELD_MAX_BYTES = 64 * 1024
+# Seconds allowed for receiving a whole upload body
+UPLOAD_BODY_TIMEOUT = int(os.getenv("UPLOAD_BODY_TIMEOUT", "600"))
+
+# Quart turns away bodies whose declared Content-Length is over MAX_CONTENT_LENGTH (16 MB by default);
+# uploads without one are counted by receive_pdf_upload as they arrive
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+inflight_upload_bytes = 0
+
+# Assistant runs generating MCQs for one PDF at the same time
+MCQ_CHUNK_CONCURRENCY = max(1, int(os.getenv("MCQ_CHUNK_CONCURRENCY", "6")))
+# Most chunks of a PDF to generate from (0 = every chunk), and how they are picked:
+# "first" takes the leading chunks, "spread" samples evenly across the whole document,
+# "best" takes the chunks with the most clinical content
+MCQ_MAX_CHUNKS = max(0, int(os.getenv("MCQ_MAX_CHUNKS", "0")))
+MCQ_CHUNK_SAMPLING = os.getenv("MCQ_CHUNK_SAMPLING", "first").lower()
+CHUNK_SAMPLING_MODES = ("first", "spread", "best")
+# Default file format of the generated MCQ export: xlsx, csv or jsonl
+MCQ_EXPORT_FORMAT = os.getenv("MCQ_EXPORT_FORMAT", "xlsx").lower()
+# Origin used in download links; defaults to the host the generation request came in on
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+artifact_store = get_artifact_store()
+mcq_result_cache = get_mcq_result_cache()
+relevance_checker = get_relevance_checker(client)
+chunk_gate = get_chunk_gate()
+# Background Cloudinary copies still in flight, cancelled on shutdown
+artifact_replications = set()
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def multipart_events(max_bytes):
+    """Decode the multipart request body into werkzeug events as its chunks arrive.
+
+    Raises ``UploadTooLarge`` as soon as more than ``max_bytes`` of body have been received,
+    whether or not the client declared a Content-Length, and ``ValueError`` for a malformed body.
+    """
+    _, options = parse_options_header(request.headers.get('Content-Type'))
+    if request.mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise ValueError("Expected a multipart/form-data upload")
+    decoder = multipart.MultipartDecoder(options['boundary'].encode('latin-1'))
+    received = 0
+    async for data in request.body:
+        received += len(data)
+        if received > max_bytes:
+            raise UploadTooLarge(f"PDF exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+        decoder.receive_data(data)
+        while not isinstance(event := decoder.next_event(), multipart.NeedData):
+            yield event
+    decoder.receive_data(None)
+    while not isinstance(event := decoder.next_event(), multipart.Epilogue):
+        yield event
+
+
+def write_upload_block(f, digest, block):
+    digest.update(block)
+    f.write(block)
+
+
+async def receive_pdf_upload(task_id, max_bytes):
+    """Read an upload form, writing its ``pdf`` part to the upload folder as it arrives.
+
+    File writes and hashing run off the event loop. Returns the text fields and, when a
+    PDF was sent, its ``filename``, ``path`` and sha256 ``digest`` (``None`` otherwise).
+    """
+    fields = {}
+    field_bytes = 0
+    upload = f = digest = None
+    current = None
+    pending = bytearray()
+    try:
+        async for event in multipart_events(max_bytes):
+            if isinstance(event, multipart.File):
+                current = None
+                if event.name == 'pdf' and event.filename and upload is None:
+                    filename = secure_filename(event.filename)
+                    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
+                    upload = {'filename': filename, 'path': path}
+                    f = await asyncio.to_thread(open, path, 'wb')
+                    digest = hashlib.sha256()
+                    current = f
+            elif isinstance(event, multipart.Field):
+                current = fields.setdefault(event.name, bytearray())
+            elif isinstance(event, multipart.Data):
+                if current is f and f is not None:
+                    pending += event.data
+                    if len(pending) >= UPLOAD_COPY_CHUNK_BYTES or not event.more_data:
+                        await asyncio.to_thread(write_upload_block, f, digest, bytes(pending))
+                        pending.clear()
+                elif current is not None:
+                    field_bytes += len(event.data)
+                    if field_bytes > UPLOAD_FIELD_MAX_BYTES:
+                        raise UploadTooLarge("Form fields are too large")
+                    current += event.data
+        if f is not None:
+            await asyncio.to_thread(f.close)
+            upload['digest'] = digest.hexdigest()
+    except BaseException:
+        if f is not None:
+            f.close()
+            remove_upload(upload['path'])
+        raise
+    return {name: bytes(value).decode('utf-8', 'replace') for name, value in fields.items()}, upload
+
+
+def remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_stale_uploads(folder, older_than):
+    """Delete files in ``folder`` last modified before the ``older_than`` timestamp."""
+    removed = 0
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.stat().st_mtime < older_than:
+            remove_upload(entry.path)
+            removed += 1
+    return removed
+
+
 # Cloudinary Config
 cloudinary.config(
     cloud_name="dgxolaza9",
@@ -519,28 +1159,65 @@ cloudinary.config(
 
 @app.route('/start-generate-mcqs', methods=['POST'])
 async def start_generate_mcqs():
-    try:
-        form_files = await request.files
-        pdf = form_files.get('pdf')
+    global inflight_upload_bytes
+    declared = request.content_length
+    if declared is not None and declared > MAX_UPLOAD_BYTES:
+        return jsonify({'error': f"PDF exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"}), 413
 
-        if not pdf:
-            return jsonify({'error': 'No PDF uploaded'}), 400
+    # Reserve the upload's size against the in-flight budget before any of the body is read
+    reserved = declared if declared is not None else MAX_UPLOAD_BYTES
+    if inflight_upload_bytes and inflight_upload_bytes + reserved > MAX_INFLIGHT_UPLOAD_BYTES:
+        return jsonify({'error': 'Too many uploads in progress, please retry shortly'}), 503, {'Retry-After': '5'}
+    inflight_upload_bytes += reserved
 
+    try:
         task_id = str(uuid.uuid4())
+        # Read the form ourselves so the PDF goes to disk as it arrives and the size limit
+        # holds for uploads without a Content-Length
+        try:
+            form, upload = await asyncio.wait_for(receive_pdf_upload(task_id, MAX_UPLOAD_BYTES), UPLOAD_BODY_TIMEOUT)
+        except UploadTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        except asyncio.TimeoutError:
+            return jsonify({'error': 'Upload timed out'}), 408
+        except ValueError as e:
+            return jsonify({'error': f"Malformed upload: {e}"}), 400
+
+        if not upload:
+            return jsonify({'error': 'No PDF uploaded'}), 400
+        pdf_path, filename, pdf_digest = upload['path'], upload['filename'], upload['digest']
+
+        try:
+            max_chunks = int_field(form.get('maxChunks'), MCQ_MAX_CHUNKS, 0)
+        except ValueError:
+            remove_upload(pdf_path)
+            return jsonify({'error': 'maxChunks must be an integer'}), 400
+        sampling = (form.get('sampling') or MCQ_CHUNK_SAMPLING).lower()
+        if sampling not in CHUNK_SAMPLING_MODES:
+            remove_upload(pdf_path)
+            return jsonify({'error': f"sampling must be one of {', '.join(CHUNK_SAMPLING_MODES)}"}), 400
+        export_format = (form.get('format') or MCQ_EXPORT_FORMAT).lower()
+        if export_format not in MCQ_EXPORT_FORMATS:
+            remove_upload(pdf_path)
+            return jsonify({'error': f"format must be one of {', '.join(MCQ_EXPORT_FORMATS)}"}), 400
+        # force=true regenerates even when this PDF was already processed with the same settings
+        force = (form.get('force') or '').lower() in ('1', 'true', 'yes')
+
+        base_url = PUBLIC_BASE_URL or request.host_url.rstrip('/')
+
         mcq_tasks[task_id] = {
             'status': 'queued',
             'progress': 'Queued',
             'download_url': None,
-            'error': None
+            'error': None,
+            'startedAt': time.time()
         }
 
-        filename = secure_filename(pdf.filename)
-        pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}")
-        file_bytes = pdf.read()
-        file_buffer = BytesIO(file_bytes)
-
         # ✅ Launch the async task and store it for cancellation support
-        task = asyncio.create_task(save_and_process(file_buffer, task_id, pdf_path, filename))
+        task = asyncio.create_task(
+            save_and_process(task_id, pdf_path, filename, max_chunks, sampling, export_format, base_url,
+                             pdf_digest, force)
+        )
 
         mcqs_running_tasks[task_id] = task
 
@@ -563,28 +1240,38 @@ async def start_generate_mcqs():
 
         # Run the wrapped task
         asyncio.create_task(wrapped_task())
+        await publish_new_task(task_id, "mcq")
 
         return jsonify({'task_id': task_id}), 202
 
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"PDF exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"}), 413
+
     except Exception as outer_e:
         print(f"[STARTUP ERROR] Failed to launch MCQ task: {str(outer_e)}", flush=True)
         return jsonify({'error': str(outer_e)}), 500
 
+    finally:
+        inflight_upload_bytes -= reserved
 
-async def save_and_process(file_buffer: BytesIO, task_id, pdf_path, filename):
-    try:
-        # Save PDF file to the designated path
-        with open(pdf_path, 'wb') as f:
-            f.write(file_buffer.read())
 
-        # Proceed with MCQ generation
-        await process_mcqs_task(task_id, pdf_path, filename)
+async def save_and_process(task_id, pdf_path, filename, max_chunks=MCQ_MAX_CHUNKS,
+                           sampling=MCQ_CHUNK_SAMPLING, export_format=MCQ_EXPORT_FORMAT, base_url=PUBLIC_BASE_URL,
+                           pdf_digest=None, force=False):
+    try:
+        # Proceed with MCQ generation on the uploaded PDF
+        await process_mcqs_task(task_id, pdf_path, filename, max_chunks, sampling, export_format, base_url,
+                                pdf_digest, force)
 
     except Exception as e:
         mcq_tasks[task_id]['status'] = 'error'
         mcq_tasks[task_id]['error'] = str(e)
         print(f"[MCQ TASK] {task_id} - ERROR: {str(e)}")
 
+    finally:
+        # The export lives in the artifact store, so the upload is no longer needed (also on cancel)
+        await asyncio.to_thread(remove_upload, pdf_path)
+
 
 mcqs_running_tasks = {}
 
@@ -592,96 +1279,320 @@ mcqs_running_tasks = {}
 @app.route("/cancel-mcq-task/<task_id>", methods=["POST", "GET"])
 async def cancel_mcq_task(task_id):
     print("CANCEL MCQ IS CALLED")
-    task = mcqs_running_tasks.get(task_id)
-    if task and not task.done():
-        task.cancel()
-        print(f"[CANCEL] Task {task_id} was cancelled by user.", flush=True)
-    mcq_tasks[task_id]["status"] = "cancelled"
-    mcq_tasks[task_id]["error"] = "Cancelled by user."
-    mcqs_running_tasks.pop(task_id, None)
+    if task_id in mcq_tasks:
+        cancel_local_task(task_id, mcq_tasks, mcqs_running_tasks)
+    elif not (task_store and await task_store.request_cancel(task_id)):
+        return jsonify({'error': 'Invalid task ID'}), 404
     return "", 200
 
 
 @app.route('/mcq-status/<task_id>', methods=['GET'])
 async def get_mcq_status(task_id):
-    task_info = mcq_tasks.get(task_id)
+    task_info = await load_task_entry(task_id, mcq_tasks, "mcq", requested_cursor())
     if not task_info:
         return jsonify({'error': 'Invalid task ID'}), 404
-    return jsonify(task_info)
-
-
-async def process_mcqs_task(task_id, pdf_path, filename):
     try:
-        mcq_tasks[task_id]['status'] = 'processing'
-        mcq_tasks[task_id]['progress'] = 'Extracting text...'
-        print(f"[MCQ TASK] {task_id} - {mcq_tasks[task_id]['progress']}")
-        await asyncio.sleep(0)  # Ensure async context
+        return jsonify(await task_status_payload(task_info))
+    except ValueError:
+        return jsonify({'error': 'cursor must be a non-negative integer'}), 400
+
+
+@app.route('/mcq-progress/<task_id>', methods=['GET'])
+async def mcq_progress_stream(task_id):
+    return await progress_stream_response(task_id, mcq_tasks, mcqs_running_tasks, "mcq")
+
+
+async def gate_chunks(task_id, chunks, bypass=False):
+    """Number the chunks of ``chunks`` and yield ``(chunk_number, chunk, score)`` for those worth
+    generating from. Skipped chunks go to the task's ``skippedChunks`` with the reason and score,
+    and ``chunkGate`` counts kept chunks and skipped ones per reason.
+
+    With ``bypass`` every chunk is yielded with its score and the previous pass's skip
+    records are kept; ``chunkGate`` is marked ``bypassed``.
+    """
+    entry = mcq_tasks[task_id]
+    if bypass:
+        entry['chunkGate']['bypassed'] = True
+    else:
+        entry['skippedChunks'] = []
+        entry['chunkGate'] = {'kept': 0, 'skipped': {}}
+    skipped = entry['skippedChunks']
+    summary = entry['chunkGate']
+    try:
+        number = 0
+        async for chunk in chunks:
+            number += 1
+            assessment = chunk_gate.assess(chunk) if chunk_gate else {'score': None, 'reason': None}
+            if bypass:
+                yield number, chunk, assessment['score']
+                continue
+            if assessment['reason']:
+                skipped.append({'chunk': number, **assessment})
+                summary['skipped'][assessment['reason']] = summary['skipped'].get(assessment['reason'], 0) + 1
+                continue
+            summary['kept'] += 1
+            yield number, chunk, assessment['score']
+    finally:
+        await chunks.aclose()
 
-        # Extract text from PDF (blocking operation offloaded to a thread)
-        full_text = await asyncio.to_thread(extract_pdf_text, pdf_path)
-        await asyncio.sleep(0)
 
-        # Chunk the extracted text
-        chunks = await asyncio.to_thread(sliding_window_chunks, full_text, 1200, 600)
-        await asyncio.sleep(0)
+async def select_chunks(chunks, max_chunks=0, sampling="first"):
+    """Yield ``(chunk_number, chunk)`` for the ``(chunk_number, chunk, score)`` items MCQs are generated from.
+
+    With ``max_chunks`` 0 every chunk is used. "first" stops reading after ``max_chunks``
+    chunks; "spread" reads the whole document, keeping an evenly strided subset of at most
+    ``2 * max_chunks`` chunks in memory, and picks ``max_chunks`` evenly spaced ones from it;
+    "best" keeps the ``max_chunks`` highest scoring chunks and yields them in document order.
+    """
+    try:
+        if not max_chunks or sampling == "first":
+            picked = 0
+            async for number, chunk, _ in chunks:
+                picked += 1
+                yield number, chunk
+                if picked == max_chunks:
+                    return
+            return
 
-        # Check if the content is clinically relevant
-        is_relevant = await asyncio.to_thread(is_clinically_relevant, client, chunks[0])
-        if not is_relevant:
-            mcq_tasks[task_id]['status'] = 'error'
-            mcq_tasks[task_id]['error'] = 'PDF is not clinically relevant'
+        if sampling == "best":
+            # Min-heap on (score, -number): ties keep the earlier chunk
+            best = []
+            async for number, chunk, score in chunks:
+                item = (score or 0, -number, chunk)
+                if len(best) < max_chunks:
+                    heapq.heappush(best, item)
+                elif item[:2] > best[0][:2]:
+                    heapq.heapreplace(best, item)
+            for _, negative_number, chunk in sorted(best, key=lambda item: -item[1]):
+                yield -negative_number, chunk
             return
 
-        all_mcqs = []
-        for i, chunk in enumerate(chunks[:4]):
+        kept = []
+        stride = 1
+        seen = 0
+        async for number, chunk, _ in chunks:
+            seen += 1
+            if (seen - 1) % stride == 0:
+                kept.append((seen, number, chunk))
+                if len(kept) > 2 * max_chunks:
+                    stride *= 2
+                    kept = [item for item in kept if (item[0] - 1) % stride == 0]
+        picks = min(max_chunks, len(kept))
+        for i in range(picks):
+            _, number, chunk = kept[i * (len(kept) - 1) // (picks - 1) if picks > 1 else 0]
+            yield number, chunk
+    finally:
+        await chunks.aclose()
+
+
+async def generate_chunk_mcqs(task_id, chunks):
+    """Generate MCQs for ``(chunk_number, chunk)`` pairs with at most MCQ_CHUNK_CONCURRENCY runs at once.
+
+    Chunks are read only as run slots free up. Each chunk's status record (``chunk``,
+    ``status``, ``questions`` or ``error``) is appended to the task's ``results`` in chunk
+    order, and the generated MCQ blocks are returned in chunk order.
+    """
+    entry = mcq_tasks[task_id]
+    entry['results'] = []
+    entry['chunksRunning'] = 0
+    slots = asyncio.Semaphore(MCQ_CHUNK_CONCURRENCY)
+    generated = {}
+    finished = {}
+    next_index = 1
+    running = set()
+
+    def publish(record):
+        nonlocal next_index
+        finished[record['index']] = record
+        while next_index in finished:
+            entry['results'].append(finished.pop(next_index))
+            next_index += 1
+        total = entry.get('total')
+        entry['progress'] = f"Processed {len(entry['results'])} of {total} chunks..." if total \
+            else f"Processed {len(entry['results'])} chunk(s)..."
+
+    async def run_chunk(index, number, chunk):
+        entry['chunksRunning'] += 1
+        try:
+            # Generate MCQs for each chunk on the shared async client
+            mcqs = await generate_mcqs(mcq_backend, task_id, mcqs_running_tasks, chunk)
+            generated[index] = mcqs
+            if mcqs:
+                record = {'index': index, 'chunk': number, 'status': 'completed',
+                          'questions': sum(len(block.get('questions', [])) for block in mcqs)}
+            else:
+                record = {'index': index, 'chunk': number, 'status': 'failed', 'error': 'No MCQs generated'}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record = {'index': index, 'chunk': number, 'status': 'failed', 'error': str(e)}
+        finally:
+            entry['chunksRunning'] -= 1
+        print(f"[MCQ TASK] {task_id} - Chunk {number}: {record['status']}")
+        publish(record)
+
+    def release(task):
+        running.discard(task)
+        slots.release()
+
+    try:
+        index = 0
+        async for number, chunk in chunks:
+            await slots.acquire()
             if task_id not in mcqs_running_tasks:
-                print(f"[MCQ TASK] {task_id} - Detected cancellation before chunk {i + 1}.", flush=True)
+                print(f"[MCQ TASK] {task_id} - Detected cancellation before chunk {number}.", flush=True)
                 raise asyncio.CancelledError()
-            mcq_tasks[task_id]['progress'] = f'Processing chunk {i + 1} of {len(chunks)}...'
+            index += 1
+            task = asyncio.create_task(run_chunk(index, number, chunk))
+            running.add(task)
+            task.add_done_callback(release)
+        entry['total'] = index
+        await asyncio.gather(*running)
+    except BaseException:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+
+    return [block for index in sorted(generated) for block in generated[index]]
+
+
+async def process_mcqs_task(task_id, pdf_path, filename, max_chunks=MCQ_MAX_CHUNKS, sampling=MCQ_CHUNK_SAMPLING,
+                            export_format=MCQ_EXPORT_FORMAT, base_url=PUBLIC_BASE_URL, pdf_digest=None, force=False):
+    try:
+        mcq_tasks[task_id]['status'] = 'processing'
+        await asyncio.sleep(0)  # Ensure async context
+
+        # A PDF already processed with the same settings reuses its MCQ set and only re-exports it
+        cache_key = mcq_result_key(pdf_digest, max_chunks, sampling, GEN_ASSISTANT_ID) if pdf_digest else None
+        cached = None
+        if mcq_result_cache and cache_key and not force:
+            cached = await mcq_result_cache.get(cache_key)
+
+        if cached:
+            final_mcqs, dedup_stats = cached['mcqs'], cached['dedup']
+            mcq_tasks[task_id]['cached'] = True
+            print(f"[MCQ TASK] {task_id} - Reusing cached MCQ set")
+        else:
+            mcq_tasks[task_id]['progress'] = 'Extracting text...'
             print(f"[MCQ TASK] {task_id} - {mcq_tasks[task_id]['progress']}")
-            await asyncio.sleep(0)
 
-            # Generate MCQs for each chunk (offload OpenAI interaction)
-            mcqs = await asyncio.to_thread(generate_mcqs_with_assistant, client, GEN_ASSISTANT_ID, task_id,
-                                           mcqs_running_tasks, chunk)
-            all_mcqs.extend(mcqs)
+            # Pages are extracted and chunked in a worker thread while earlier chunks are processed
+            # Front matter, indexes and other chunks without clinical content never reach generation
+            chunks = select_chunks(gate_chunks(task_id, stream_pdf_chunks(pdf_path)), max_chunks, sampling)
+            try:
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    if not mcq_tasks[task_id]['skippedChunks']:
+                        raise Exception("PDF does not contain any extractable text")
+                    # The gate is only a local heuristic and must not veto a whole document: with every
+                    # chunk gated out, the relevance check below decides on the first raw chunk, and a
+                    # relevant document is generated from without gating
+                    await chunks.aclose()
+                    chunks = select_chunks(
+                        gate_chunks(task_id, stream_pdf_chunks(pdf_path), bypass=True), max_chunks, sampling
+                    )
+                    first = await chunks.__anext__()
+
+                # Check if the content is clinically relevant (clear cases are decided locally)
+                relevance = await relevance_checker.check(first[1], pdf_digest)
+                mcq_tasks[task_id]['relevance'] = relevance
+                if not relevance['relevant']:
+                    mcq_tasks[task_id]['status'] = 'error'
+                    mcq_tasks[task_id]['error'] = 'PDF is not clinically relevant'
+                    return
+
+                async def selected():
+                    yield first
+                    async for item in chunks:
+                        yield item
+
+                mcq_tasks[task_id]['progress'] = 'Generating MCQs...'
+                all_mcqs = await generate_chunk_mcqs(task_id, selected())
+            finally:
+                await chunks.aclose()
+
+            # Deduplicate the generated MCQs
+            dedup_stats = {}
+            final_mcqs = await asyncio.to_thread(deduplicate_mcqs, all_mcqs, stats=dedup_stats)
+            print(f"[MCQ TASK] {task_id} - Kept {dedup_stats['kept']} of {dedup_stats['input']} MCQs after dedup")
 
-        # Deduplicate the generated MCQs
-        mcq_tasks[task_id]['progress'] = 'Exporting MCQs to Excel...'
+            # Sets with failed chunks are incomplete, so only fully generated ones are cached
+            failed = any(record['status'] == 'failed' for record in mcq_tasks[task_id]['results'])
+            if mcq_result_cache and cache_key and not failed:
+                await mcq_result_cache.put(cache_key, final_mcqs, dedup_stats)
+
+        mcq_tasks[task_id]['dedup'] = dedup_stats
+        mcq_tasks[task_id]['progress'] = f'Exporting MCQs to {export_format.upper()}...'
         print(f"[MCQ TASK] {task_id} - {mcq_tasks[task_id]['progress']}")
         await asyncio.sleep(0)
 
-        final_mcqs = await asyncio.to_thread(deduplicate_mcqs, all_mcqs)
-        temp_excel_path = os.path.join("/tmp", filename.replace('.pdf', '_mcqs.xlsx'))
+        extension = MCQ_EXPORT_FORMATS[export_format]
+        download_name = filename.replace('.pdf', f'_mcqs{extension}')
+        # The task id keeps concurrent exports of same-named PDFs apart until the file is stored
+        export_path = os.path.join(tempfile.gettempdir(), f"{task_id}_{download_name}")
 
-        # Export MCQs to Excel
-        await asyncio.to_thread(mcqs_to_excel, final_mcqs, temp_excel_path)
+        # Export MCQs row by row in the requested format
+        await asyncio.to_thread(export_mcqs, final_mcqs, export_path, export_format)
+        artifact = await asyncio.to_thread(artifact_store.put_file, export_path, download_name)
+
+        mcq_tasks[task_id]['status'] = 'completed'
+        mcq_tasks[task_id]['progress'] = '✅ Generation complete.'
+        mcq_tasks[task_id]['artifact'] = artifact
+        mcq_tasks[task_id]['download_url'] = f"{base_url}/artifacts/{artifact['id']}"
+        print(f"[MCQ TASK] {task_id} - Task completed.")
+
+        if ARTIFACT_REPLICATION == 'cloudinary':
+            replication = asyncio.create_task(replicate_artifact(task_id, artifact, export_format))
+            artifact_replications.add(replication)
+            replication.add_done_callback(artifact_replications.discard)
+
+    except Exception as e:
+        mcq_tasks[task_id]['status'] = 'error'
+        mcq_tasks[task_id]['error'] = str(e)
+        print(f"[MCQ TASK] {task_id} - ERROR: {str(e)}")
 
-        mcq_tasks[task_id]['progress'] = 'Uploading to Cloudinary...'
-        print(f"[MCQ TASK] {task_id} - {mcq_tasks[task_id]['progress']}")
-        await asyncio.sleep(0)
 
-        # Upload the Excel file to Cloudinary
+async def replicate_artifact(task_id, artifact, export_format):
+    """Copy a stored export to Cloudinary and record its URL as ``replica_url`` on the task."""
+    extension = MCQ_EXPORT_FORMATS[export_format]
+    # Other formats keep their extension so they don't overwrite the xlsx
+    public_id = artifact['name'][:-len(extension)] if export_format == 'xlsx' else artifact['name']
+    try:
         upload_result = await asyncio.to_thread(
             cloudinary.uploader.upload,
-            temp_excel_path,
+            artifact_store.path(artifact['id']),
             resource_type="raw",
             folder="mcqs_outputs",
-            public_id=filename.replace('.pdf', '_mcqs'),
+            public_id=public_id,
             use_filename=True,
             unique_filename=False,
             overwrite=True
         )
+        replica = {'replica_url': upload_result.get('secure_url')}
+    except Exception as e:
+        print(f"[MCQ TASK] {task_id} - Cloudinary replication failed: {e}")
+        replica = {'replica_error': str(e)}
 
-        mcq_tasks[task_id]['status'] = 'completed'
-        mcq_tasks[task_id]['progress'] = '✅ Generation complete.'
-        mcq_tasks[task_id]['download_url'] = upload_result.get('secure_url')
-        print(f"[MCQ TASK] {task_id} - Task completed.")
+    entry = mcq_tasks.get(task_id)
+    if entry is not None:
+        entry.update(replica)
 
-    except Exception as e:
-        mcq_tasks[task_id]['status'] = 'error'
-        mcq_tasks[task_id]['error'] = str(e)
-        print(f"[MCQ TASK] {task_id} - ERROR: {str(e)}")
+
+@app.route("/artifacts/<artifact_id>", methods=["GET"])
+async def download_artifact(artifact_id):
+    """Stream a stored export; ``Range`` requests get partial content."""
+    artifact = await asyncio.to_thread(artifact_store.describe, artifact_id)
+    if not artifact:
+        return jsonify({'error': 'Artifact not found'}), 404
+    return await send_file(
+        artifact_store.path(artifact_id),
+        mimetype=artifact['contentType'],
+        as_attachment=True,
+        attachment_filename=artifact['name'],
+        conditional=True
+    )
 
 
 @app.route("/delete-description", methods=["POST"])
@@ -719,15 +1630,25 @@ async def generate_missing_descriptions():
     try:
         print("HIT /generate-missing-descriptions", flush=True)
 
+        data = await request.get_json(silent=True) or {}
+        try:
+            batch_size = int_field(data.get("batchSize"), EXPLANATION_BATCH_SIZE, 1)
+        except ValueError:
+            return jsonify({"status": "error", "error": "batchSize must be an integer"}), 400
+
         task_id = str(uuid.uuid4())
         task_status[task_id] = {
             "status": "queued",
             "progress": "Queued",
             "results": [],
-            "error": None
+            "error": None,
+            "startedAt": time.time()
         }
 
-        task = asyncio.create_task(process_all_questions_without_description(task_id))
+        if data.get("mode") == "offline":
+            task = asyncio.create_task(process_all_questions_offline(task_id))
+        else:
+            task = asyncio.create_task(process_all_questions_without_description(task_id, batch_size))
         running_tasks[task_id] = task
 
         async def wrapped_task():
@@ -746,6 +1667,7 @@ async def generate_missing_descriptions():
                 running_tasks.pop(task_id, None)
 
         asyncio.create_task(wrapped_task())
+        await publish_new_task(task_id, "explanation")
 
         return jsonify({"status": "started", "taskId": task_id})
     except Exception as e:
@@ -770,17 +1692,17 @@ async def get_all_question_count():
     return jsonify(resp)
 
 
-async def process_all_questions_without_description(task_id):
+async def process_all_questions_without_description(task_id, batch_size=EXPLANATION_BATCH_SIZE):
     print("HIT generate-missing-descriptions route")
     try:
         print(f"[TASK START] Global explanation generation task started: {task_id}")
 
-        print("Fetching all questions with NULL descriptions...")
-        query = "SELECT questionId FROM tblquestion WHERE description IS NULL"
+        print("Counting questions with NULL descriptions...")
+        query = "SELECT COUNT(*) AS count FROM tblquestion WHERE description IS NULL"
         response = await execute_query(query)
-        question_ids = [int(row["questionId"]) for row in response.get("data", [])]
+        total = response["data"][0]["count"] if response.get("data") else 0
 
-        if not question_ids:
+        if not total:
             print("No questions found with NULL description. Exiting.")
             task_status[task_id] = {
                 "status": "completed",
@@ -790,123 +1712,64 @@ async def process_all_questions_without_description(task_id):
             }
             return
 
-        print(f"{len(question_ids)} question(s) to process.")
-        label_map = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        print(f"{total} question(s) to process.")
+        task_status[task_id]["total"] = total
 
         idx = 0
-        for batch_ids in batchify(question_ids, size=50):
-            ids_placeholders = ",".join(["%s"] * len(batch_ids))
-
-            query_q = f"SELECT questionId, question FROM tblquestion WHERE questionId IN ({ids_placeholders})"
-            response_questions = await execute_query(query_q, batch_ids)
-            questions = response_questions.get("data", [])
-
-            query_opts = f"SELECT questionId, questionImageText, isCorrectAnswer FROM tblquestionoption WHERE questionId IN ({ids_placeholders})"
-            response_options = await execute_query(query_opts, batch_ids)
-            options = response_options.get("data", [])
-
-            for q in questions:
-                idx += 1
-                try:
-                    if task_id not in running_tasks:
-                        raise asyncio.CancelledError()
-
-                    await asyncio.sleep(0)
-
-                    q_opts = [opt for opt in options if opt["questionId"] == q["questionId"]]
-                    correct = next((opt for opt in q_opts if opt["isCorrectAnswer"] == "1"), None)
-
+        after_id = 0
+        writer = WriteBehindBuffer(bulk_update_descriptions, on_saved=drop_saved_explanation)
+        try:
+            while True:
+                # Keyset paging: rows explained (or failed) in earlier pages are never revisited
+                questions = await load_pending_bundle_page(after_id, QUESTION_PAGE_SIZE)
+                if not questions:
+                    break
+                after_id = questions[-1]["questionId"]
+
+                def question_block(q):
+                    q_opts = q["options"]
                     if not q_opts:
                         raise Exception("No options found.")
+                    return format_question_block(q['question'], q_opts)
 
-                    labeled_opts = []
-                    correct_label = ""
-                    for i, opt in enumerate(q_opts):
-                        label = label_map[i]
-                        labeled_opts.append(f"{label}. {opt['questionImageText']}")
-                        if opt["isCorrectAnswer"] == "1":
-                            correct_label = label
-
-                    prompt = (
-                            f"Question: {q['question']}\nOptions:\n" +
-                            "\n".join(labeled_opts) +
-                            f"\nCorrect Answer: {correct_label}\n\nExplain why the correct option is right."
-                    )
-
-                    thread = await safe_to_thread(
-                        client.beta.threads.create,
-                        messages=[{"role": "user", "content": prompt}],
-                        timeout=SETUP_TIMEOUT
-                    )
-                    if thread is None:
-                        raise Exception("Failed to create thread")
-
-                    run = await safe_to_thread(
-                        client.beta.threads.runs.create,
-                        thread_id=thread.id,
-                        assistant_id=EX_ASSISTANT_ID,
-                        timeout=SETUP_TIMEOUT
-                    )
-                    if run is None:
-                        raise Exception("Failed to start run")
-
-                    for _ in range(MAX_WAIT_SECONDS):
-                        if task_id not in running_tasks:
-                            raise asyncio.CancelledError()
-
-                        run = await safe_to_thread(
-                            client.beta.threads.runs.retrieve,
-                            thread_id=thread.id,
-                            run_id=run.id,
-                            timeout=SETUP_TIMEOUT
-                        )
-                        if run and run.status == "completed":
-                            break
-                        await asyncio.sleep(1)
-                    else:
-                        raise Exception("Assistant timeout")
-
-                    messages = await safe_to_thread(
-                        client.beta.threads.messages.list,
-                        thread_id=thread.id,
-                        timeout=SETUP_TIMEOUT
-                    )
-                    if not messages or not messages.data:
-                        raise Exception("No assistant message returned")
-
-                    explanation = messages.data[0].content[0].text.value
+                async def explain(idx, q, final_explanation=None):
                     try:
-                        explanation_json = json.loads(explanation)
-                        final_explanation = explanation_json.get("explanation", explanation)
-                    except Exception:
-                        final_explanation = explanation
-
-                    update_query = "UPDATE tblquestion SET description = %s WHERE questionId = %s"
-                    update_response = await execute_query(update_query, (final_explanation, int(q['questionId'])))
-
-                    if update_response.get("error"):
-                        raise Exception("DB update failed")
-
-                    task_status[task_id]["results"].append({
-                        "index": idx,
-                        "questionId": q["questionId"],
-                        "question": q["question"],
-                        "options": [opt["questionImageText"] for opt in q_opts],
-                        "correctAnswer": correct["questionImageText"] if correct else None,
-                        "explanation": final_explanation
-                    })
-                    task_status[task_id]["progress"] = idx
-
-                except asyncio.CancelledError:
-                    print(f"[CANCELLED] Task {task_id} during question {idx}")
-                    raise
-                except Exception as e:
-                    print(f"[ERROR] Question {idx} (ID={q['questionId']}) failed {e}")
-                    task_status[task_id]["results"].append({
-                        "index": idx,
-                        "questionId": q["questionId"],
-                        "error": str(e)
-                    })
+                        q_opts = q["options"]
+                        if not q_opts:
+                            raise Exception("No options found.")
+
+                        cached = final_explanation is None and "cachedExplanation" in q
+                        if cached:
+                            final_explanation = q["cachedExplanation"]
+                        else:
+                            if final_explanation is None:
+                                prompt = format_question_block(q['question'], q_opts) + "\n\nExplain why the correct option is right."
+                                final_explanation = parse_explanation(await request_explanation(task_id, prompt))
+                            await remember_explanations([(q, final_explanation)])
+
+                        record = {"index": idx, "questionId": q["questionId"], "explanation": final_explanation}
+                        if cached:
+                            record["cached"] = True
+                        await writer.add(int(q['questionId']), final_explanation, record)
+                        return record
+
+                    except asyncio.CancelledError:
+                        print(f"[CANCELLED] Task {task_id} during question {idx}")
+                        raise
+                    except Exception as e:
+                        print(f"[ERROR] Question {idx} (ID={q['questionId']}) failed {e}")
+                        return {
+                            "index": idx,
+                            "questionId": q["questionId"],
+                            "error": str(e)
+                        }
+
+                await attach_cached_explanations(task_id, questions, question_block)
+                jobs = explanation_jobs(questions, idx + 1, batch_size)
+                await run_question_pool(task_id, jobs, explanation_worker(task_id, explain, question_block, batch_size))
+                idx += len(questions)
+        finally:
+            await writer.close()
 
         task_status[task_id]["status"] = "completed"
         print(f"[TASK DONE] Task {task_id} finished processing {idx} questions.")
@@ -928,20 +1791,14 @@ async def delete_question_descriptions_by_topic():
         topic_name = data.get("topicName")
 
         # Step 1: Resolve subjectId
-        query_subject = "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s"
-        res_sub = await execute_query(query_subject, (category_id, subject_name))
-        subject_data = res_sub.get("data", [])
-        if not subject_data:
+        subject_id = await hierarchy.subject_id(category_id, subject_name)
+        if subject_id is None:
             return jsonify({"status": "error", "message": "Subject not found"}), 404
-        subject_id = subject_data[0]["id"]
 
         # Step 2: Resolve topicId
-        query_topic = "SELECT id FROM topics WHERE subjectId = %s AND topicName = %s"
-        res_topic = await execute_query(query_topic, (subject_id, topic_name))
-        topic_data = res_topic.get("data", [])
-        if not topic_data:
+        topic_id = await hierarchy.topic_id(subject_id, topic_name)
+        if topic_id is None:
             return jsonify({"status": "error", "message": "Topic not found"}), 404
-        topic_id = topic_data[0]["id"]
 
         # Step 3: Get relevant questionIds
         query_qids = "SELECT questionId FROM topicQueRel WHERE topicId = %s"
@@ -974,14 +1831,10 @@ async def get_all_topic_question_count():
         subject_name = data.get("subjectName")
 
         # Step 1: Get subject ID
-        query_subject = "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s"
-        res_sub = await execute_query(query_subject, (category_id, subject_name))
-        subject_data = res_sub.get("data", [])
-        if not subject_data:
+        subject_id = await hierarchy.subject_id(category_id, subject_name)
+        if subject_id is None:
             raise Exception("Subject not found")
 
-        subject_id = subject_data[0]["id"]
-
         # Step 2: Count all questions with NULL description in all topics
         query_count = """
             SELECT COUNT(*) as total FROM tblquestion q 
@@ -1000,172 +1853,265 @@ async def get_all_topic_question_count():
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
-async def process_all_topics_for_subject(task_id: str, category_id: int, subject_name: str):
+async def process_all_questions_offline(task_id):
+    """Global backfill through a batch-processing backend instead of interactive runs.
+
+    Pending prompts are written to a JSONL request file, submitted as one batch job,
+    and the result file is bulk-applied to ``tblquestion`` once the job finishes.
+    """
+    try:
+        print(f"[TASK START] Offline explanation batch job started: {task_id}")
+        task_status[task_id]["status"] = "processing"
+        task_status[task_id]["progress"] = 0
+
+        query = "SELECT COUNT(*) AS count FROM tblquestion WHERE description IS NULL"
+        response = await execute_query(query)
+        total = response["data"][0]["count"] if response.get("data") else 0
+
+        if not total:
+            task_status[task_id] = {
+                "status": "completed",
+                "progress": 0,
+                "results": [],
+                "error": "All questions already have explanations."
+            }
+            return
+
+        task_status[task_id]["total"] = total
+        if BATCH_BACKEND == "local":
+            # The local stand-in never calls the API, so it runs without looking up the assistant
+            model, instructions = EXPLANATION_BATCH_MODEL or "local", ""
+        else:
+            assistant = await safe_await(client.beta.assistants.retrieve(EX_ASSISTANT_ID))
+            if assistant is None:
+                raise Exception("Failed to load explanation assistant")
+            model, instructions = EXPLANATION_BATCH_MODEL or assistant.model, assistant.instructions
+        backend = get_batch_backend(client)
+
+        idx = 0
+        part = 0
+        after_id = 0
+        exhausted = False
+        while not exhausted:
+            part += 1
+            task_status[task_id]["phase"] = f"Preparing batch {part}..."
+            records = []
+            pending = {}
+            lines = []
+            # questionId -> (index, explanation, question, answered from the cache)
+            explained = {}
+
+            while len(records) + len(explained) + len(lines) < BATCH_MAX_REQUESTS:
+                questions = await load_pending_bundle_page(
+                    after_id, min(QUESTION_PAGE_SIZE, BATCH_MAX_REQUESTS - len(records) - len(explained) - len(lines))
+                )
+                if not questions:
+                    exhausted = True
+                    break
+                after_id = questions[-1]["questionId"]
+                await attach_cached_explanations(
+                    task_id, [q for q in questions if q["options"]],
+                    lambda q: format_question_block(q['question'], q['options'])
+                )
+
+                for q in questions:
+                    idx += 1
+                    q_opts = q["options"]
+                    if not q_opts:
+                        records.append({"index": idx, "questionId": q["questionId"], "error": "No options found."})
+                        continue
+                    if "cachedExplanation" in q:
+                        explained[q["questionId"]] = (idx, q["cachedExplanation"], q, True)
+                        continue
+
+                    prompt = format_question_block(q["question"], q_opts) + "\n\nExplain why the correct option is right."
+                    custom_id = f"q-{q['questionId']}"
+                    lines.append(build_request_line(custom_id, model, instructions, prompt))
+                    pending[custom_id] = (idx, q)
+
+            if lines:
+                request_path = os.path.join(BATCH_JOB_FOLDER, f"{task_id}_{part}_requests.jsonl")
+                output_path = os.path.join(BATCH_JOB_FOLDER, f"{task_id}_{part}_results.jsonl")
+                try:
+                    await asyncio.to_thread(write_request_file, request_path, lines)
+
+                    batch_id = await backend.submit(request_path)
+                    task_status[task_id].setdefault("batchIds", []).append(batch_id)
+                    task_status[task_id]["phase"] = f"Waiting for batch {batch_id} ({len(lines)} requests)..."
+                    print(f"📦 Submitted batch {batch_id} with {len(lines)} request(s)")
+
+                    await backend.wait(batch_id, output_path, lambda: task_id not in running_tasks)
+                    batch_results = await asyncio.to_thread(read_result_file, output_path)
+                finally:
+                    # The results are applied from memory below, so the JSONL files are no longer needed
+                    await asyncio.to_thread(remove_job_files, request_path, output_path)
+
+                task_status[task_id]["phase"] = f"Applying batch {batch_id}..."
+                generated = []
+                for custom_id, (index, q) in pending.items():
+                    result = batch_results.get(custom_id) or {"error": "Missing from batch output"}
+                    if "error" in result:
+                        records.append({"index": index, "questionId": q["questionId"], "error": result["error"]})
+                    else:
+                        text = parse_explanation(result["content"])
+                        explained[q["questionId"]] = (index, text, q, False)
+                        generated.append((q, text))
+                await remember_explanations(generated)
+
+            if explained:
+                failed = await bulk_update_descriptions([(qid, text) for qid, (_, text, _, _) in explained.items()])
+                for qid, (index, text, _, cached) in explained.items():
+                    if qid in failed:
+                        record = {"index": index, "questionId": qid, "explanation": text,
+                                  "writeStatus": "failed", "error": "DB update failed"}
+                    else:
+                        record = {"index": index, "questionId": qid, "writeStatus": "saved"}
+                    if cached:
+                        record["cached"] = True
+                    records.append(record)
+
+            records.sort(key=lambda r: r["index"])
+            task_status[task_id]["results"].extend(records)
+            task_status[task_id]["progress"] = idx
+
+        task_status[task_id]["status"] = "completed"
+        task_status[task_id]["phase"] = None
+        print(f"[TASK DONE] Offline task {task_id} finished processing {idx} questions.")
+
+    except Exception as outer_e:
+        print(f"[FATAL TASK ERROR] Task {task_id} {outer_e}")
+        task_status[task_id] = {
+            "status": "failed",
+            "error": str(outer_e)
+        }
+
+
+# Prepended to the subject-wide prompts to steer the assistant away from refusals
+SUBJECT_PROMPT_PREAMBLE = "Remove any RefusalContentBlock text and then answer which of the following definitions correctly matches the concept according to general public health principles"
+
+
+async def process_all_topics_for_subject(task_id: str, category_id: int, subject_name: str,
+                                         batch_size: int = EXPLANATION_BATCH_SIZE):
     count = 0
     try:
         print(
             f"\n🚀 [START] Task {task_id} - Processing all topics for subject '{subject_name}' (categoryId={category_id})")
 
         # === Subject ID ===
-        query_subject = "SELECT id FROM subject WHERE categoryId = %s AND subjectName = %s"
-        res_sub = await execute_query(query_subject, (category_id, subject_name))
-        subject_data = res_sub.get("data", [])
-        if not subject_data:
+        subject_id = await hierarchy.subject_id(category_id, subject_name)
+        if subject_id is None:
             raise Exception("Subject not found")
-        subject_id = subject_data[0]["id"]
         print(f"✅ Found subject ID: {subject_id}")
 
         # === Topics ===
-        query_topics = "SELECT id, topicName FROM topics WHERE subjectId = %s"
-        res_topics = await execute_query(query_topics, (subject_id,))
-        topics_data = res_topics.get("data", [])
+        topics_data = await hierarchy.topics(subject_id)
         if not topics_data:
             raise Exception("No topics found")
         print(f"📚 Found {len(topics_data)} topic(s) under subject '{subject_name}'")
 
-        label_map = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        task_status[task_id] = {"status": "running", "progress": 0, "results": [], "error": None}
-        global_index = 0
-
-        for topic in topics_data:
-            topic_id = topic["id"]
-            topic_name = topic["topicName"]
-            print(f"\n▶️ [TOPIC] Starting topic '{topic_name}' (id={topic_id})")
-
-            # === Questions with NULL description ===
-            query_qids = """
-                SELECT q.questionId, q.question FROM tblquestion q 
-                JOIN topicQueRel rel ON rel.questionId = q.questionId 
-                WHERE rel.topicId = %s AND 
-                (q.description IS NULL OR TRIM(q.description) = '')
-            """
-            res_qs = await execute_query(query_qids, (topic_id,))
-            qs_data = res_qs.get("data", [])
-            print(f"🧠 Found {len(qs_data)} question(s) needing explanation in topic '{topic_name}'")
-
-            if not qs_data:
-                continue
-
-            question_ids = [str(q["questionId"]) for q in qs_data]
-            ids_placeholders = ",".join(["%s"] * len(question_ids))
+        # Questions linked to several topics are explained once, so count them once
+        res_count = await execute_query(
+            """SELECT COUNT(DISTINCT q.questionId) AS total FROM tblquestion q
+               JOIN topicQueRel rel ON rel.questionId = q.questionId
+               JOIN topics t ON t.id = rel.topicId
+               WHERE t.subjectId = %s AND (q.description IS NULL OR TRIM(q.description) = '')""",
+            (subject_id,)
+        )
+        total = res_count["data"][0]["total"] if res_count.get("data") else None
 
-            # === Options ===
-            query_opts = f"SELECT questionId, questionImageText, isCorrectAnswer FROM tblquestionoption WHERE questionId IN ({ids_placeholders})"
-            res_opts = await execute_query(query_opts, question_ids)
-            opts_data = res_opts.get("data", [])
+        started_at = task_status.get(task_id, {}).get("startedAt", time.time())
+        task_status[task_id] = {
+            "status": "running", "progress": 0, "results": [], "error": None,
+            "startedAt": started_at, "total": total
+        }
+        global_index = 0
 
-            for q in qs_data:
-                try:
-                    global_index += 1
-                    qid = q["questionId"]
-                    print(f"\n📝 [QUESTION {global_index}] Processing QID={qid}")
+        writer = WriteBehindBuffer(bulk_update_descriptions, on_saved=drop_saved_explanation)
+        try:
+            for topic in topics_data:
+                topic_id = topic["id"]
+                topic_name = topic["topicName"]
+                print(f"\n▶️ [TOPIC] Starting topic '{topic_name}' (id={topic_id})")
 
-                    if task_id not in running_tasks:
-                        raise asyncio.CancelledError()
+                # Questions shared with earlier topics must not look unexplained while still buffered
+                await writer.flush()
 
-                    await asyncio.sleep(0)
+                # === Questions with NULL description, with their options ===
+                qs_data = await load_topic_bundles(topic_id, BLANK_DESCRIPTION)
+                print(f"🧠 Found {len(qs_data)} question(s) needing explanation in topic '{topic_name}'")
 
-                    q_opts = [opt for opt in opts_data if opt["questionId"] == qid]
-                    correct = next((opt for opt in q_opts if opt["isCorrectAnswer"] == "1"), None)
+                if not qs_data:
+                    continue
 
-                    if not q_opts or not correct:
+                def question_block(q):
+                    q_opts = q["options"]
+                    if not q_opts or not any(opt["isCorrectAnswer"] == "1" for opt in q_opts):
                         raise Exception("Missing options or correct answer")
+                    return format_question_block(q['question'], q_opts)
 
-                    labeled_opts = []
-                    correct_label = ""
-                    for i, opt in enumerate(q_opts):
-                        label = label_map[i]
-                        labeled_opts.append(f"{label}. {opt['questionImageText']}")
-                        if opt["isCorrectAnswer"] == "1":
-                            correct_label = label
-
-                    print(f"Question: {q['question']}\nOptions:\n" +
-                          "\n".join(labeled_opts) +
-                          f"\nCorrect Answer: {correct_label}\n\nExplain why the correct option is right.")
-                    prompt = (
-                            f"Remove any RefusalContentBlock text and then answer which of the following definitions correctly matches the concept according to general public health principles\nQuestion: {q['question']}\nOptions:\n" +
-                            "\n".join(labeled_opts) +
-                            f"\nCorrect Answer: {correct_label}\n\nExplain why the correct option is right."
-                    )
-
-                    print(f"🤖 Generating explanation using Assistant API...")
-
-                    thread = await safe_to_thread(
-                        client.beta.threads.create,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
-                    run = await safe_to_thread(
-                        client.beta.threads.runs.create,
-                        thread_id=thread.id,
-                        assistant_id=EX_ASSISTANT_ID
-                    )
-
-                    for wait in range(MAX_WAIT_SECONDS):
-                        if task_id not in running_tasks:
-                            raise asyncio.CancelledError()
-                        run = await safe_to_thread(
-                            client.beta.threads.runs.retrieve,
-                            thread_id=thread.id,
-                            run_id=run.id
-                        )
-                        if run and run.status == "completed":
-                            break
-                        await asyncio.sleep(1)
-                    else:
-                        raise Exception("Timeout waiting for Assistant")
-
-                    messages = await safe_to_thread(
-                        client.beta.threads.messages.list,
-                        thread_id=thread.id
-                    )
-
-                    first_message = messages.data[0]
-                    first_block = first_message.content[0]
-
-                    if hasattr(first_block, "text"):
-                        explanation = first_block.text.value
-                        try:
-                            parsed = json.loads(explanation)
-                            final_explanation = parsed.get("explanation", explanation)
-                        except Exception:
-                            final_explanation = explanation
-                    else:
+                async def explain(index, q, final_explanation=None):
+                    try:
+                        qid = q["questionId"]
+                        print(f"\n📝 [QUESTION {index}] Processing QID={qid}")
+
+                        q_opts = q["options"]
+                        correct = next((opt for opt in q_opts if opt["isCorrectAnswer"] == "1"), None)
+
+                        if not q_opts or not correct:
+                            raise Exception("Missing options or correct answer")
+
+                        refused = False
+                        cached = final_explanation is None and "cachedExplanation" in q
+                        if cached:
+                            final_explanation = q["cachedExplanation"]
+                        elif final_explanation is None:
+                            question_text = format_question_block(q['question'], q_opts) + "\n\nExplain why the correct option is right."
+                            print(question_text)
+                            prompt = SUBJECT_PROMPT_PREAMBLE + "\n" + question_text
+
+                            print(f"🤖 Generating explanation...")
+
+                            try:
+                                final_explanation = parse_explanation(await request_explanation(task_id, prompt))
+                            except NonTextReply as reply:
+                                refused = True
+                                print(f"⚠️ [WARNING] OpenAI returned a non-text block ({reply.kind}) for QID={qid}")
+                                final_explanation = f"[OpenAI refused to answer because of privacy issues. Block type: {reply.kind}]"
+
+                        record = {"index": index, "topic": topic_name, "questionId": qid, "explanation": final_explanation}
+                        if cached:
+                            record["cached"] = True
+
+                        if not refused and "RefusalContentBlock" not in final_explanation:
+                            if not cached:
+                                await remember_explanations([(q, final_explanation)])
+                            await writer.add(int(qid), final_explanation, record)
+                        else:
+                            print(f"🚫 Skipping DB update for QID={qid} due to OpenAI refusal.")
+                            record["writeStatus"] = "skipped"
+
+                        return record
+
+                    except asyncio.CancelledError:
                         print(
-                            f"⚠️ [WARNING] OpenAI returned a non-text block ({type(first_block).__name__}) for QID={qid}")
-                        final_explanation = f"[OpenAI refused to answer because of privacy issues. Block type: {type(first_block).__name__}]"
-
-                    if "RefusalContentBlock" not in final_explanation:
-                        update_query = "UPDATE tblquestion SET description = %s WHERE questionId = %s"
-                        update_res = await execute_query(update_query, (final_explanation, int(qid)))
-                        if update_res.get("error"):
-                            raise Exception("DB update failed")
-                        print(f"✅ Explanation stored in DB for QID={qid}")
-                    else:
-                        print(f"🚫 Skipping DB update for QID={qid} due to OpenAI refusal.")
-
-                    task_status[task_id]["results"].append({
-                        "index": global_index,
-                        "topic": topic_name,
-                        "questionId": qid,
-                        "question": q["question"],
-                        "options": [opt["questionImageText"] for opt in q_opts],
-                        "correctAnswer": correct["questionImageText"],
-                        "explanation": final_explanation
-                    })
-                    task_status[task_id]["progress"] = global_index
-
-                except asyncio.CancelledError:
-                    print(
-                        f"❌ [CANCELLED] Task {task_id} cancelled during topic '{topic_name}' at question {global_index}")
-                    raise
-                except Exception as e:
-                    print(f"🔥 [ERROR] Question {q['questionId']} failed: {str(e)}")
-                    task_status[task_id]["results"].append({
-                        "index": global_index,
-                        "topic": topic_name,
-                        "questionId": q["questionId"],
-                        "error": str(e)
-                    })
+                            f"❌ [CANCELLED] Task {task_id} cancelled during topic '{topic_name}' at question {index}")
+                        raise
+                    except Exception as e:
+                        print(f"🔥 [ERROR] Question {q['questionId']} failed: {str(e)}")
+                        return {
+                            "index": index,
+                            "topic": topic_name,
+                            "questionId": q["questionId"],
+                            "error": str(e)
+                        }
+
+                await attach_cached_explanations(task_id, qs_data, question_block, SUBJECT_PROMPT_PREAMBLE)
+                jobs = explanation_jobs(qs_data, global_index + 1, batch_size)
+                worker = explanation_worker(task_id, explain, question_block, batch_size, SUBJECT_PROMPT_PREAMBLE)
+                await run_question_pool(task_id, jobs, worker)
+                global_index += len(qs_data)
+        finally:
+            await writer.close()
 
         task_status[task_id]["status"] = "completed"
         print(f"\n🏁 [DONE] Task {task_id} completed. Total questions processed: {global_index}")
@@ -1184,36 +2130,154 @@ async def generate_all_topic_descriptions():
         data = await request.get_json()
         category_id = int(data.get("categoryId"))
         subject_name = data.get("subjectName")
+        try:
+            batch_size = int_field(data.get("batchSize"), EXPLANATION_BATCH_SIZE, 1)
+        except ValueError:
+            return jsonify({"status": "error", "error": "batchSize must be an integer"}), 400
 
         task_id = str(uuid.uuid4())
         task_status[task_id] = {
             "status": "queued",
             "progress": 0,
             "results": [],
-            "error": None
+            "error": None,
+            "startedAt": time.time()
         }
 
-        task = asyncio.create_task(process_all_topics_for_subject(task_id, category_id, subject_name))
+        task = asyncio.create_task(process_all_topics_for_subject(task_id, category_id, subject_name, batch_size))
         running_tasks[task_id] = task
+        task.add_done_callback(lambda _: running_tasks.pop(task_id, None))
+        await publish_new_task(task_id, "explanation")
 
         return jsonify({"status": "started", "taskId": task_id})
     except Exception as e:
         return jsonify({"status": "error", "error": str(e)}), 500
 
 
+# ==================================== SHARED TASK STATE
+# Each worker publishes snapshots of the tasks it runs so any worker can answer status
+# requests, and picks up cancellations that other workers recorded for its tasks.
+
+# task_id -> (last published snapshot, number of result records already stored)
+published_tasks = {}
+task_sync_loop = None
+
+
+def task_kinds():
+    return (("explanation", task_status, running_tasks), ("mcq", mcq_tasks, mcqs_running_tasks))
+
+
+async def publish_task(kind, task_id, entry, running):
+    snapshot, stored = published_tasks.get(task_id, (None, 0))
+    results = entry.get("results")
+
+    # Results are stored once settled, i.e. no longer waiting on a buffered DB write
+    settled = stored
+    if results is not None:
+        if len(results) < stored:
+            stored = 0
+        settled = settled_count(results, stored)
+
+    state = {key: value for key, value in entry.items() if key != "results"}
+    if results is not None:
+        state["results"] = []
+        state["resultCount"] = settled
+        state["failedResults"] = sum(1 for record in results[:settled] if "error" in record)
+    current = (json.dumps(state, sort_keys=True, default=str), settled)
+    if current == snapshot:
+        return
+
+    finished = entry.get("status") in FINISHED_STATUSES and task_id not in running
+    await task_store.save_state(task_id, kind, state, finished)
+    if settled > stored:
+        await task_store.append_results(task_id, stored, results[stored:settled])
+    published_tasks[task_id] = (current, settled)
+
+
+async def publish_new_task(task_id, kind):
+    """Store a task as soon as it is created, so other workers can answer for it before the next sync."""
+    if not task_store:
+        return
+    for registry_kind, registry, running in task_kinds():
+        if registry_kind == kind and task_id in registry:
+            try:
+                await publish_task(kind, task_id, registry[task_id], running)
+            except Exception as e:
+                print(f"⚠️ Failed to publish new task {task_id}: {e}")
+
+
+async def publish_task_state():
+    for kind, registry, running in task_kinds():
+        for task_id, entry in list(registry.items()):
+            await publish_task(kind, task_id, entry, running)
+
+    live = {task_id for _, registry, _ in task_kinds() for task_id in registry}
+    for task_id in list(published_tasks):
+        if task_id not in live:
+            published_tasks.pop(task_id, None)
+
+
+async def deliver_cancellations():
+    for task_id in await task_store.cancel_requests():
+        for _, registry, running in task_kinds():
+            if task_id in running:
+                cancel_local_task(task_id, registry, running)
+
+
+async def run_task_state_sync():
+    last_purge = 0
+    while True:
+        try:
+            await publish_task_state()
+            await deliver_cancellations()
+            if time.time() - last_purge > 300:
+                await task_store.purge(time.time() - TASK_RETENTION_SECONDS)
+                last_purge = time.time()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Task state sync failed: {e}")
+        await asyncio.sleep(TASK_SYNC_INTERVAL)
+
+
 # Initialize database pool on startup
 @app.before_serving
 async def startup():
+    global task_sync_loop
     await init_db_pool()
+    removed = await asyncio.to_thread(
+        purge_stale_uploads, app.config['UPLOAD_FOLDER'], time.time() - UPLOAD_RETENTION_SECONDS
+    )
+    if removed:
+        print(f"🧹 Removed {removed} stale uploads")
+    if ARTIFACT_RETENTION_SECONDS > 0:
+        removed = await asyncio.to_thread(artifact_store.purge, time.time() - ARTIFACT_RETENTION_SECONDS)
+        if removed:
+            print(f"🧹 Removed {removed} expired artifacts")
+    if task_store:
+        await task_store.init()
+        task_sync_loop = asyncio.create_task(run_task_state_sync())
 
 
 # Clean up database pool on shutdown
 @app.after_serving
 async def shutdown():
     global db_pool
+    # Buffered explanations must reach the database before the pool goes away
+    await flush_all_buffers()
+    if task_sync_loop:
+        task_sync_loop.cancel()
+        try:
+            await publish_task_state()
+        except Exception as e:
+            print(f"⚠️ Final task state publish failed: {e}")
+    for replication in list(artifact_replications):
+        replication.cancel()
     if db_pool:
         db_pool.close()
         await db_pool.wait_closed()
+    shutdown_pdf_pool()
+    await client.close()
 
 
 # === ASGI ENTRYPOINT ===
@@ -1222,4 +2286,4 @@ if __name__ == "__main__":
     from hypercorn.config import Config
 
     config = Config()
-    asyncio.run(serve(app, config))
\ No newline at end of file
+    asyncio.run(serve(app, config))
\ No newline at end of file
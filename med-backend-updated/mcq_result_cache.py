@@ -0,0 +1,87 @@
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+
+from q_generation_func import MCQ_CHUNK_TOKENS, MCQ_CHUNK_OVERLAP_TOKENS, MCQ_DEDUP_MODE, MCQ_DEDUP_THRESHOLD
+from generation_backends import MCQ_BACKEND, CHAT_BACKEND_MODEL
+from clinical_relevance import MCQ_CHUNK_GATING, MCQ_CHUNK_MIN_SCORE, MCQ_CHUNK_MIN_WORDS
+
+# Directory of cached MCQ sets per PDF and generation parameters; empty disables the cache
+MCQ_RESULT_CACHE_PATH = os.getenv("MCQ_RESULT_CACHE_PATH", "mcq_result_cache")
+# Bump when generation changes in a way the key parameters don't capture
+MCQ_RESULT_CACHE_VERSION = 1
+
+
+def mcq_result_key(pdf_digest, max_chunks, sampling, assistant_id):
+    """Key for the MCQ set generated from the PDF with sha256 ``pdf_digest``.
+
+    Chunking, chunk gating and selection, the MCQ backend and deduplication settings are part of
+    the key, so changing any of them regenerates instead of returning a stale set.
+    """
+    params = {
+        "version": MCQ_RESULT_CACHE_VERSION,
+        "chunkTokens": MCQ_CHUNK_TOKENS,
+        "overlapTokens": MCQ_CHUNK_OVERLAP_TOKENS,
+        "maxChunks": max_chunks,
+        "sampling": sampling,
+        "chunkGate": [MCQ_CHUNK_GATING, MCQ_CHUNK_MIN_SCORE, MCQ_CHUNK_MIN_WORDS],
+        "backend": MCQ_BACKEND,
+        "assistant": assistant_id,
+        "model": CHAT_BACKEND_MODEL,
+        "dedup": [MCQ_DEDUP_MODE, MCQ_DEDUP_THRESHOLD],
+    }
+    payload = json.dumps([pdf_digest, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MCQResultCache:
+    """Deduplicated MCQ sets with their dedup stats, one JSON file per key under ``root``."""
+
+    def __init__(self, root=MCQ_RESULT_CACHE_PATH):
+        self.root = root
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _get_sync(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _put_sync(self, key, record):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, staging_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(staging_path, path)
+        except BaseException:
+            os.remove(staging_path)
+            raise
+
+    async def get(self, key):
+        """The cached ``{"mcqs", "dedup"}`` record for ``key``, or ``None``."""
+        record = await asyncio.to_thread(self._get_sync, key)
+        self.stats["hits" if record else "misses"] += 1
+        return record
+
+    async def put(self, key, mcqs, dedup):
+        await asyncio.to_thread(self._put_sync, key, {"mcqs": mcqs, "dedup": dedup})
+        self.stats["stored"] += 1
+
+    def describe(self):
+        return {**self.stats, "path": self.root}
+
+
+def get_mcq_result_cache(path=None):
+    """The configured cache, or ``None`` when MCQ_RESULT_CACHE_PATH is empty."""
+    path = MCQ_RESULT_CACHE_PATH if path is None else path
+    if not path:
+        return None
+    return MCQResultCache(path)
@@ -1,57 +1,351 @@
 import os
+import re
+import csv
 import fitz  # PyMuPDF
-import pandas as pd
 import json
-import time
+import random
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Processes used to extract large PDFs (1 keeps extraction in the calling thread)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages handed to one worker at a time; smaller PDFs than two ranges are read in-thread
+PDF_PAGES_PER_RANGE = int(os.getenv("PDF_PAGES_PER_RANGE", "40"))
+
+# Chunk size for MCQ generation in (locally estimated) tokens, and tokens shared by neighbouring chunks
+MCQ_CHUNK_TOKENS = int(os.getenv("MCQ_CHUNK_TOKENS", "1500"))
+MCQ_CHUNK_OVERLAP_TOKENS = int(os.getenv("MCQ_CHUNK_OVERLAP_TOKENS", "100"))
+
+# Local token estimate: words and individual punctuation marks, close to BPE counts for prose
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# "near" also drops paraphrased questions (MinHash similarity >= threshold), "exact" only identical text
+MCQ_DEDUP_MODE = os.getenv("MCQ_DEDUP_MODE", "near").lower()
+MCQ_DEDUP_THRESHOLD = float(os.getenv("MCQ_DEDUP_THRESHOLD", "0.8"))
+MINHASH_PERMUTATIONS = 64
+
+# Fixed 64-bit masks; XOR-ing the shingle hashes with each one stands in for a permutation
+# (far cheaper than (a * x + b) mod p in Python) and keeps signatures stable across runs
+_minhash_rng = random.Random(20240601)
+MINHASH_MASKS = [_minhash_rng.getrandbits(64) for _ in range(MINHASH_PERMUTATIONS)]
+
+_pdf_pool = None
+
+# Yield the stripped text of each non-empty page, one page in memory at a time
+def iter_pdf_pages(file_path):
+    with fitz.open(file_path) as doc:
+        for page in doc:
+            text = page.get_text().strip()
+            if text:
+                yield text
+
+# Text of the non-empty pages in [start, stop); runs inside a pool worker process
+def extract_page_range(file_path, start, stop):
+    with fitz.open(file_path) as doc:
+        texts = (doc[i].get_text().strip() for i in range(start, stop))
+        return [text for text in texts if text]
+
+# Shared extraction pool. "spawn" keeps workers free of the server's threads and event loop.
+def get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+# A pool whose worker died (MuPDF crash, OOM kill) stays broken; drop it so the next use starts a fresh one
+def discard_pdf_pool(pool):
+    global _pdf_pool
+    if _pdf_pool is pool:
+        _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+# ``(stop, texts)`` of consecutive page ranges from page ``first`` on, extracted in ``pool``
+# with at most two ranges per worker in flight
+def iter_page_ranges(pool, file_path, first, page_count, workers, pages_per_range):
+    pending = deque()
+    try:
+        for start in range(first, page_count, pages_per_range):
+            stop = min(start + pages_per_range, page_count)
+            pending.append((stop, pool.submit(extract_page_range, file_path, start, stop)))
+            if len(pending) >= 2 * workers:
+                stop, future = pending.popleft()
+                yield stop, future.result()
+        while pending:
+            stop, future = pending.popleft()
+            yield stop, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+# Like iter_pdf_pages, but page ranges are extracted in the process pool and yielded in page
+# order, so memory stays bounded on large PDFs. If the pool breaks, extraction resumes once on
+# a fresh pool from the first page not yet yielded; a second break fails this PDF only.
+def iter_pdf_pages_parallel(file_path, workers=PDF_EXTRACT_WORKERS, pages_per_range=PDF_PAGES_PER_RANGE):
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+    if workers <= 1 or page_count < 2 * pages_per_range:
+        yield from iter_pdf_pages(file_path)
+        return
+
+    resume = 0
+    for attempt in range(2):
+        pool = get_pdf_pool()
+        try:
+            for stop, texts in iter_page_ranges(pool, file_path, resume, page_count, workers, pages_per_range):
+                yield from texts
+                resume = stop
+            return
+        except BrokenProcessPool:
+            discard_pdf_pool(pool)
+            if attempt:
+                raise RuntimeError(f"PDF extraction workers crashed twice at page {resume + 1}")
+            print(f"⚠️ PDF extraction pool broke at page {resume + 1}; retrying on a fresh pool")
 
 # Extract text from PDF
 def extract_pdf_text(file_path):
-    doc = fitz.open(file_path)
-    full_text = ""
-    for page in doc:
-        text = page.get_text()
-        if text.strip():
-            full_text += text.strip() + " "
-    return full_text
-
-# Sliding window text chunking
-def sliding_window_chunks(text, window_size=1200, step_size=600):
-    words = text.split()
-    return [" ".join(words[i:i + window_size]) for i in range(0, len(words) - window_size + 1, step_size)]
-
-# Remove duplicate questions
-def deduplicate_mcqs(mcq_list):
+    return "".join(text + " " for text in iter_pdf_pages_parallel(file_path))
+
+# Character offsets ``(start, end)`` of token-budgeted chunks over text segments joined by single
+# spaces. Each chunk holds at most ``max_tokens`` tokens, consecutive chunks share
+# ``overlap_tokens``, and the last chunk always reaches the end of the text, so a document
+# shorter than one chunk still gives one.
+def iter_chunk_spans(segments, max_tokens=MCQ_CHUNK_TOKENS, overlap_tokens=MCQ_CHUNK_OVERLAP_TOKENS):
+    if max_tokens < 1 or not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("Chunking needs max_tokens >= 1 and 0 <= overlap_tokens < max_tokens")
+    starts = deque()  # offsets of the tokens in the current chunk
+    end = 0
+    fresh = 0  # tokens no emitted chunk covers yet
+    base = 0
+    for segment in segments:
+        for match in TOKEN_PATTERN.finditer(segment):
+            if len(starts) == max_tokens:
+                yield starts[0], end
+                for _ in range(max_tokens - overlap_tokens):
+                    starts.popleft()
+                fresh = 0
+            starts.append(base + match.start())
+            end = base + match.end()
+            fresh += 1
+        base += len(segment) + 1
+    if fresh > 0:
+        yield starts[0], end
+
+# Token-budgeted chunks of ``text``: one slice of the source per chunk, no word lists
+def token_budget_chunks(text, max_tokens=MCQ_CHUNK_TOKENS, overlap_tokens=MCQ_CHUNK_OVERLAP_TOKENS):
+    return [text[start:end] for start, end in iter_chunk_spans([text], max_tokens, overlap_tokens)]
+
+# token_budget_chunks over pages joined by spaces, produced as the pages arrive. Only the pages
+# the upcoming chunk can still span are kept in memory.
+def stream_token_chunks(pages, max_tokens=MCQ_CHUNK_TOKENS, overlap_tokens=MCQ_CHUNK_OVERLAP_TOKENS):
+    held = deque()  # (offset, text) of the pages read so far that chunks may still start in
+    text_end = 0
+
+    def segments():
+        nonlocal text_end
+        for text in pages:
+            held.append((text_end, text))
+            text_end += len(text) + 1
+            yield text
+
+    for start, end in iter_chunk_spans(segments(), max_tokens, overlap_tokens):
+        while len(held) > 1 and held[1][0] <= start:
+            held.popleft()
+        first = held[0][0]
+        yield " ".join(text for _, text in held)[start - first:end - first]
+
+# Token-budgeted chunks of a PDF, yielded while pages are still being extracted in a thread of
+# its own (it blocks on the queue for as long as generation runs, so it stays out of the default
+# executor). At most ``max_buffered`` chunks wait in memory; closing the generator stops extraction.
+async def stream_pdf_chunks(file_path, max_tokens=MCQ_CHUNK_TOKENS, overlap_tokens=MCQ_CHUNK_OVERLAP_TOKENS,
+                            max_buffered=4):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        pages = iter_pdf_pages_parallel(file_path)
+        try:
+            for chunk in stream_token_chunks(pages, max_tokens, overlap_tokens):
+                if stop.is_set():
+                    return
+                put(chunk)
+            put(end)
+        except Exception as e:
+            if not stop.is_set():
+                put(e)
+        finally:
+            pages.close()
+
+    producer = loop.create_future()
+
+    def run():
+        try:
+            produce()
+        finally:
+            loop.call_soon_threadsafe(producer.set_result, None)
+
+    threading.Thread(target=run, name="pdf-chunks", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Keep draining so a producer blocked on a full queue can see the stop flag
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.wait([producer], timeout=0.05)
+
+# Word 3-grams of a question's text and options, lowercased and without punctuation
+def mcq_shingles(question):
+    options = question.get("options") or {}
+    values = options.values() if isinstance(options, dict) else options
+    words = re.findall(r"\w+", " ".join([str(question.get("question", ""))] + [str(v) for v in values]).lower())
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def minhash_signature(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min([h ^ mask for h in hashes]) for mask in MINHASH_MASKS)
+
+def signature_similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+# LSH banding (bands, rows) whose candidate threshold (1/bands)^(1/rows) is the highest one
+# still below ``threshold``: similar pairs almost always share a band and are then verified
+def lsh_bands(threshold, num_perm=MINHASH_PERMUTATIONS):
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in options if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below, key=lambda br: (1 / br[0]) ** (1 / br[1])) if below else options[0]
+
+# Remove duplicate questions. Identical question text is always dropped; in "near" mode a
+# question is also dropped when its estimated Jaccard similarity to a kept question reaches
+# ``threshold``. Kept questions are indexed in LSH band buckets, so each question is only
+# compared with the few that share a bucket. ``stats``, if given, receives the counts.
+def deduplicate_mcqs(mcq_list, mode=MCQ_DEDUP_MODE, threshold=MCQ_DEDUP_THRESHOLD, stats=None):
+    if mode not in ("exact", "near"):
+        raise ValueError(f"Unknown dedup mode: {mode}")
+    bands, rows = lsh_bands(threshold)
+    buckets = [{} for _ in range(bands)]
+    kept_signatures = []
+    counts = {"mode": mode, "threshold": threshold, "input": 0, "kept": 0,
+              "exactDuplicates": 0, "nearDuplicates": 0, "comparisons": 0}
+
     seen = set()
     unique_mcqs = []
     for block in mcq_list:
         topic = block.get("topic") or block.get("temat")
         questions = []
         for q in block.get("questions", []):
-            if q["question"] not in seen:
-                seen.add(q["question"])
-                questions.append(q)
+            counts["input"] += 1
+            if q["question"] in seen:
+                counts["exactDuplicates"] += 1
+                continue
+
+            if mode == "near":
+                signature = minhash_signature(mcq_shingles(q))
+                keys = [signature[i * rows:(i + 1) * rows] for i in range(bands)]
+                candidates = set()
+                for bucket, key in zip(buckets, keys):
+                    candidates.update(bucket.get(key, ()))
+                counts["comparisons"] += len(candidates)
+                if any(signature_similarity(signature, kept_signatures[c]) >= threshold for c in candidates):
+                    counts["nearDuplicates"] += 1
+                    continue
+                for bucket, key in zip(buckets, keys):
+                    bucket.setdefault(key, []).append(len(kept_signatures))
+                kept_signatures.append(signature)
+
+            seen.add(q["question"])
+            questions.append(q)
         if questions:
             unique_mcqs.append({"temat": topic, "questions": questions})
+
+    counts["kept"] = counts["input"] - counts["exactDuplicates"] - counts["nearDuplicates"]
+    if stats is not None:
+        stats.update(counts)
     return unique_mcqs
 
-# Save to Excel
-def mcqs_to_excel(mcq_list, output_path):
-    rows = []
+# Export layout shared by every format
+MCQ_EXPORT_COLUMNS = [
+    "Temat", "Pytanie", "Opcja A", "Opcja B", "Opcja C", "Opcja D", "Poprawna Odpowiedź", "Wyjaśnienie"
+]
+# Export format -> file extension
+MCQ_EXPORT_FORMATS = {"xlsx": ".xlsx", "csv": ".csv", "jsonl": ".jsonl"}
+
+# One row (values in MCQ_EXPORT_COLUMNS order) per question, produced lazily from the MCQ blocks
+def iter_mcq_rows(mcq_list):
     for mcq_block in mcq_list:
         topic = mcq_block.get("topic") or mcq_block.get("temat", "")
         for question_data in mcq_block.get("questions", []):
-            rows.append({
-                "Temat": topic,
-                "Pytanie": question_data.get("question", ""),
-                "Opcja A": question_data.get("options", {}).get("A", ""),
-                "Opcja B": question_data.get("options", {}).get("B", ""),
-                "Opcja C": question_data.get("options", {}).get("C", ""),
-                "Opcja D": question_data.get("options", {}).get("D", ""),
-                "Poprawna Odpowiedź": question_data.get("answer", ""),
-                "Wyjaśnienie": question_data.get("explanation", "")
-            })
-    df = pd.DataFrame(rows)
-    df.to_excel(output_path, index=False)
+            options = question_data.get("options", {})
+            yield [
+                topic,
+                question_data.get("question", ""),
+                options.get("A", ""),
+                options.get("B", ""),
+                options.get("C", ""),
+                options.get("D", ""),
+                question_data.get("answer", ""),
+                question_data.get("explanation", "")
+            ]
+
+# Write MCQs row by row as xlsx (write-only workbook), csv or jsonl; returns the row count
+def export_mcqs(mcq_list, output_path, export_format="xlsx"):
+    rows = iter_mcq_rows(mcq_list)
+    count = 0
+    if export_format == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Sheet1")  # same sheet name pandas used
+        sheet.append(MCQ_EXPORT_COLUMNS)
+        for row in rows:
+            sheet.append(row)
+            count += 1
+        workbook.save(output_path)
+    elif export_format == "csv":
+        # utf-8-sig so Excel opens the Polish headers correctly
+        with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(MCQ_EXPORT_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    elif export_format == "jsonl":
+        with open(output_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(MCQ_EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+                count += 1
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return count
+
+# Save to Excel
+def mcqs_to_excel(mcq_list, output_path):
+    return export_mcqs(mcq_list, output_path, "xlsx")
 
 # Parse assistant response
 def parse_assistant_response(response_dict):
@@ -72,67 +366,36 @@ def extract_title_from_text(text):
     return "Unknown Topic"
 
 import asyncio
-# Generate MCQs using Assistant
-def generate_mcqs_with_assistant(client,assistant_id ,task_id, mcqs_running_tasks, text, min_required=1, max_attempts=3):
+from assistant_runs import REQUEST_TIMEOUT
+
+# Longest time a single MCQ generation may take before the attempt is abandoned
+MCQ_RUN_MAX_WAIT = 40
+
+# Generate MCQs for one chunk through a generation backend (see generation_backends.py)
+async def generate_mcqs(backend, task_id, mcqs_running_tasks, text, min_required=1, max_attempts=3):
     for attempt in range(max_attempts):
         if task_id not in mcqs_running_tasks:
-                print(f"[MCQ TASK] {task_id} - Detected cancellation before chunk {i + 1}.", flush=True)
+                print(f"[MCQ TASK] {task_id} - Detected cancellation before attempt {attempt + 1}.", flush=True)
                 raise asyncio.CancelledError()
         try:
-            thread = client.beta.threads.create()
-            client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role="user",
-                content=text
-            )
-            run = client.beta.threads.runs.create(
-                thread_id=thread.id,
-                assistant_id=assistant_id
-            )
-
-            max_tries = 20  # 🔁 Will check status up to 20 times (adjust as needed)
-            tries = 0
-
-            while tries < max_tries:
-                if task_id not in mcqs_running_tasks:
-                    print(f"[MCQ TASK] {task_id} - Detected cancellation during run polling.", flush=True)
-                    raise asyncio.CancelledError()
-                run_status = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-                if run_status.status == "completed":
-                    break
-                elif run_status.status in ["failed", "cancelled", "expired"]:
-                    raise RuntimeError(f"Run failed with status: {run_status.status}")
-
-                tries += 1
-                time.sleep(2)
-
-            if tries >= max_tries:
-                raise TimeoutError("Exceeded max retries. Run status did not complete in expected time.")
-
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
-
-            for msg in messages.data:
-                for block in msg.content:
-                    if hasattr(block, "text") and hasattr(block.text, "value"):
-                        try:
-                            parsed_quiz = json.loads(block.text.value)
-                            if parsed_quiz and parsed_quiz.get("questions"):
-                                if "topic" not in parsed_quiz or not parsed_quiz["topic"]:
-                                    parsed_quiz["topic"] = extract_title_from_text(text)  # or use fallback below
-                                    # parsed_quiz["topic"] = "Unknown Topic"  # fallback if no heading extraction logic
-                                print("Questions: ", parsed_quiz)
-                                return [parsed_quiz]
-
-                        except Exception as e:
-                            print(f"⚠️ Failed to parse text block as JSON: {e}")
+            reply = await backend.generate(text, should_cancel=lambda: task_id not in mcqs_running_tasks)
+            try:
+                parsed_quiz = json.loads(reply)
+                if parsed_quiz and parsed_quiz.get("questions"):
+                    if "topic" not in parsed_quiz or not parsed_quiz["topic"]:
+                        parsed_quiz["topic"] = extract_title_from_text(text)
+                    print("Questions: ", parsed_quiz)
+                    return [parsed_quiz]
+
+            except Exception as e:
+                print(f"⚠️ Failed to parse text block as JSON: {e}")
         except Exception as e:
-            print(f"❌ GPT Assistant Error on attempt {attempt + 1}: {e}")
-        time.sleep(2)
+            print(f"❌ MCQ generation error on attempt {attempt + 1}: {e}")
+        await asyncio.sleep(2)
 
     return []
 
-def is_clinically_relevant(client, text):
+async def is_clinically_relevant(client, text):
     prompt = (
         "Determine whether the following text is clinically relevant. "
         "Reply only with YES or NO.\n\n"
@@ -142,13 +405,16 @@ def is_clinically_relevant(client, text):
     print("📝 Prompt sent for clinical relevance check:")
     print("⏳ Waiting for model response...")
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a strict clinical relevance checker."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0,
+    response = await asyncio.wait_for(
+        client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": "You are a strict clinical relevance checker."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.0,
+        ),
+        REQUEST_TIMEOUT
     )
 
     answer = response.choices[0].message.content.strip().upper()
@@ -0,0 +1,38 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteDatabase:
+    """A local SQLite file shared between threads.
+
+    Every use opens its own connection inside one transaction, serialized by a lock,
+    and ``create_statements`` run on first use.
+    """
+
+    def __init__(self, path, create_statements=()):
+        self.path = path
+        self.create_statements = create_statements
+        self.lock = threading.Lock()
+        self.ready = False
+
+    @contextmanager
+    def connect(self):
+        with self.lock:
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                conn.row_factory = sqlite3.Row
+                with conn:
+                    if not self.ready:
+                        for statement in self.create_statements:
+                            conn.execute(statement)
+                        self.ready = True
+                    yield conn
+            finally:
+                conn.close()
+
+    def run(self, query, params=(), fetch=False):
+        """Rows as dicts when ``fetch``, else the affected row count."""
+        with self.connect() as conn:
+            cursor = conn.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()] if fetch else cursor.rowcount
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# How long finished tasks stay queryable, and the most tasks kept per registry
+TASK_RETENTION_SECONDS = float(os.getenv("TASK_RETENTION_SECONDS", str(6 * 3600)))
+TASK_MAX_ENTRIES = int(os.getenv("TASK_MAX_ENTRIES", "200"))
+# Question bundles kept for status polls across all tasks of a process
+HYDRATION_CACHE_MAX_RECORDS = int(os.getenv("HYDRATION_CACHE_MAX_RECORDS", "20000"))
+
+FINISHED_STATUSES = {"completed", "failed", "cancelled", "error"}
+
+
+def approx_size(obj, depth=4):
+    """Rough recursive ``sys.getsizeof`` over the dict/list/str shapes stored in task entries."""
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, 0) + approx_size(v, depth - 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(approx_size(v, depth - 1) for v in obj)
+    return size
+
+
+class TaskRegistry(MutableMapping):
+    """Dict of task entries that evicts finished tasks after a TTL or when over capacity.
+
+    Entries still running are never evicted. A task's TTL starts when a sweep first
+    sees it in a finished status; sweeps run whenever an entry is stored.
+    """
+
+    def __init__(self, ttl=TASK_RETENTION_SECONDS, max_entries=TASK_MAX_ENTRIES, on_remove=None):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.on_remove = on_remove
+        self._entries = OrderedDict()
+        self._finished_at = {}
+        self.evicted = 0
+
+    def __getitem__(self, task_id):
+        return self._entries[task_id]
+
+    def __setitem__(self, task_id, entry):
+        self._entries[task_id] = entry
+        self._entries.move_to_end(task_id)
+        self.sweep()
+
+    def __delitem__(self, task_id):
+        del self._entries[task_id]
+        self._finished_at.pop(task_id, None)
+        if self.on_remove:
+            self.on_remove(task_id)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, task_id):
+        del self[task_id]
+        self.evicted += 1
+
+    def sweep(self):
+        now = time.monotonic()
+        for task_id, entry in list(self._entries.items()):
+            if entry.get("status") not in FINISHED_STATUSES:
+                self._finished_at.pop(task_id, None)
+                continue
+            finished_at = self._finished_at.setdefault(task_id, now)
+            if now - finished_at > self.ttl:
+                self._evict(task_id)
+
+        # Over capacity: drop the oldest finished tasks first
+        if len(self._entries) > self.max_entries:
+            for task_id in list(self._entries):
+                if len(self._entries) <= self.max_entries:
+                    break
+                if self._entries[task_id].get("status") in FINISHED_STATUSES:
+                    self._evict(task_id)
+
+    def stats(self):
+        self.sweep()
+        finished = sum(1 for entry in self._entries.values() if entry.get("status") in FINISHED_STATUSES)
+        return {
+            "entries": len(self._entries),
+            "running": len(self._entries) - finished,
+            "finished": finished,
+            "evicted": self.evicted,
+            "results": sum(len(entry.get("results") or []) for entry in self._entries.values()),
+            "approxBytes": approx_size(self._entries),
+            "ttlSeconds": self.ttl,
+            "maxEntries": self.max_entries,
+        }
+
+
+class HydrationCache:
+    """Question text and options of settled task results, grouped by task.
+
+    Explanations are left out and read back from the database by reference. When over
+    ``max_records`` the least recently used tasks are dropped whole, and a task's
+    bundles go with it when its registry entry is removed (see ``forget``).
+    """
+
+    def __init__(self, max_records=HYDRATION_CACHE_MAX_RECORDS):
+        self.max_records = max_records
+        self._tasks = OrderedDict()
+        self._records = 0
+
+    def get(self, task_id, question_ids):
+        bundles = self._tasks.get(task_id)
+        if not bundles:
+            return {}
+        self._tasks.move_to_end(task_id)
+        return {qid: bundles[qid] for qid in question_ids if qid in bundles}
+
+    def put(self, task_id, bundles):
+        if not bundles or self.max_records <= 0:
+            return
+        cached = self._tasks.setdefault(task_id, {})
+        self._tasks.move_to_end(task_id)
+        for qid, bundle in bundles.items():
+            if qid not in cached:
+                self._records += 1
+            cached[qid] = {key: value for key, value in bundle.items() if key != "description"}
+        while self._records > self.max_records and self._tasks:
+            self._records -= len(self._tasks.popitem(last=False)[1])
+
+    def forget(self, task_id):
+        self._records -= len(self._tasks.pop(task_id, None) or ())
+
+    def stats(self):
+        return {
+            "tasks": len(self._tasks),
+            "records": self._records,
+            "approxBytes": approx_size(self._tasks, depth=6),
+            "maxRecords": self.max_records,
+        }
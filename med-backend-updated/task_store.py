@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import socket
+import asyncio
+
+from sqlite_db import SQLiteDatabase
+
+# "memory" keeps task state process-local (single worker); "sqlite" or "mysql" share it across workers
+TASK_STORE = os.getenv("TASK_STORE", "memory").lower()
+TASK_STORE_PATH = os.getenv("TASK_STORE_PATH", "task_state.sqlite3")
+# How often each worker publishes its task snapshots and picks up cancellation requests
+TASK_SYNC_INTERVAL = float(os.getenv("TASK_SYNC_INTERVAL", "1"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SQLTaskStore:
+    """Task snapshots and their result records in two tables, shared by every worker.
+
+    ``task_state`` holds one row per task (JSON state without results, owner worker,
+    cancellation flag); ``task_state_results`` holds result records by position.
+    Subclasses provide ``_run(query, params, fetch)`` and their dialect's upsert SQL.
+    """
+
+    placeholder = "?"
+    create_statements = ()
+    upsert_state_sql = ""
+    # Followed by one "(?, ?, ?)" row per record
+    insert_results_sql = ""
+    # Records written per multi-row insert
+    results_per_insert = 200
+
+    async def _run(self, query, params=(), fetch=False):
+        raise NotImplementedError
+
+    def _sql(self, query):
+        return query.replace("?", self.placeholder)
+
+    async def init(self):
+        for statement in self.create_statements:
+            await self._run(statement)
+
+    async def save_state(self, task_id, kind, state, finished):
+        await self._run(
+            self._sql(self.upsert_state_sql),
+            (task_id, kind, json.dumps(state, default=str), WORKER_ID, int(finished), time.time())
+        )
+
+    async def append_results(self, task_id, start, records):
+        for offset in range(0, len(records), self.results_per_insert):
+            chunk = records[offset:offset + self.results_per_insert]
+            params = []
+            for position, record in enumerate(chunk, start=start + offset):
+                params.extend((task_id, position, json.dumps(record, default=str)))
+            await self._run(
+                self._sql(self.insert_results_sql + ", ".join(["(?, ?, ?)"] * len(chunk))),
+                tuple(params)
+            )
+
+    async def load(self, task_id, kind, start=0):
+        """The stored state with its result records from position ``start`` on.
+
+        Earlier positions (up to the stored ``resultCount``) are filled with empty
+        placeholders so indexes and cursors work as on the owning worker.
+        """
+        rows = await self._run(
+            self._sql("SELECT state FROM task_state WHERE task_id = ? AND kind = ?"),
+            (task_id, kind),
+            fetch=True
+        )
+        if not rows:
+            return None
+        state = json.loads(rows[0]["state"])
+        if "results" in state:
+            results = await self._run(
+                self._sql("SELECT record FROM task_state_results WHERE task_id = ? AND position >= ? ORDER BY position"),
+                (task_id, start),
+                fetch=True
+            )
+            skipped = min(start, state.get("resultCount", 0))
+            state["results"] = [{}] * skipped + [json.loads(row["record"]) for row in results]
+        return state
+
+    async def request_cancel(self, task_id):
+        """Flag a task for cancellation by whichever worker owns it. Returns False if unknown."""
+        rows = await self._run(
+            self._sql("SELECT task_id FROM task_state WHERE task_id = ?"), (task_id,), fetch=True
+        )
+        if not rows:
+            return False
+        await self._run(self._sql("UPDATE task_state SET cancel_requested = 1 WHERE task_id = ?"), (task_id,))
+        return True
+
+    async def cancel_requests(self):
+        """Ids of this worker's unfinished tasks that another worker asked to cancel."""
+        rows = await self._run(
+            self._sql("SELECT task_id FROM task_state WHERE owner = ? AND cancel_requested = 1 AND finished = 0"),
+            (WORKER_ID,),
+            fetch=True
+        )
+        return {row["task_id"] for row in rows}
+
+    async def purge(self, older_than):
+        """Delete finished tasks last updated before the ``older_than`` timestamp."""
+        rows = await self._run(
+            self._sql("SELECT task_id FROM task_state WHERE finished = 1 AND updated_at < ?"),
+            (older_than,),
+            fetch=True
+        )
+        for row in rows:
+            await self._run(self._sql("DELETE FROM task_state_results WHERE task_id = ?"), (row["task_id"],))
+            await self._run(self._sql("DELETE FROM task_state WHERE task_id = ?"), (row["task_id"],))
+        return len(rows)
+
+
+class SQLiteTaskStore(SQLTaskStore):
+    """Local-file backend for development, tests, and several workers on one host."""
+
+    create_statements = (
+        """CREATE TABLE IF NOT EXISTS task_state (
+            task_id TEXT PRIMARY KEY, kind TEXT, state TEXT, owner TEXT,
+            finished INTEGER DEFAULT 0, cancel_requested INTEGER DEFAULT 0, updated_at REAL)""",
+        """CREATE TABLE IF NOT EXISTS task_state_results (
+            task_id TEXT, position INTEGER, record TEXT, PRIMARY KEY (task_id, position))""",
+    )
+    upsert_state_sql = """
+        INSERT INTO task_state (task_id, kind, state, owner, finished, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(task_id) DO UPDATE SET
+            kind = excluded.kind, state = excluded.state, owner = excluded.owner,
+            finished = excluded.finished, updated_at = excluded.updated_at
+    """
+    insert_results_sql = "INSERT OR REPLACE INTO task_state_results (task_id, position, record) VALUES "
+
+    def __init__(self, path=TASK_STORE_PATH):
+        self.path = path
+        self.db = SQLiteDatabase(path, self.create_statements)
+
+    async def _run(self, query, params=(), fetch=False):
+        return await asyncio.to_thread(self.db.run, query, params, fetch)
+
+
+class MySQLTaskStore(SQLTaskStore):
+    """Backend on the application's MySQL database through ``execute_query``."""
+
+    placeholder = "%s"
+    create_statements = (
+        """CREATE TABLE IF NOT EXISTS task_state (
+            task_id VARCHAR(64) PRIMARY KEY, kind VARCHAR(16), state LONGTEXT, owner VARCHAR(255),
+            finished TINYINT DEFAULT 0, cancel_requested TINYINT DEFAULT 0, updated_at DOUBLE,
+            INDEX idx_task_state_owner (owner, cancel_requested))""",
+        """CREATE TABLE IF NOT EXISTS task_state_results (
+            task_id VARCHAR(64), position INT, record TEXT, PRIMARY KEY (task_id, position))""",
+    )
+    upsert_state_sql = """
+        INSERT INTO task_state (task_id, kind, state, owner, finished, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON DUPLICATE KEY UPDATE
+            kind = VALUES(kind), state = VALUES(state), owner = VALUES(owner),
+            finished = VALUES(finished), updated_at = VALUES(updated_at)
+    """
+    insert_results_sql = "REPLACE INTO task_state_results (task_id, position, record) VALUES "
+
+    def __init__(self, execute_query):
+        self.execute_query = execute_query
+
+    async def _run(self, query, params=(), fetch=False):
+        response = await self.execute_query(query, params)
+        if response.get("error"):
+            raise Exception(f"Task store query failed: {response['error']}")
+        return response.get("data", []) if fetch else response.get("affected_rows")
+
+
+def get_task_store(execute_query, name=None):
+    """The configured shared store, or ``None`` for process-local task state."""
+    name = (name or TASK_STORE).lower()
+    if name == "memory":
+        return None
+    if name == "sqlite":
+        return SQLiteTaskStore()
+    if name == "mysql":
+        return MySQLTaskStore(execute_query)
+    raise ValueError(f"Unknown task store: {name}")
@@ -0,0 +1,87 @@
+import os
+import asyncio
+
+# Flush when this many rows are buffered, or this many seconds after the first buffered row
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "100"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("WRITE_BEHIND_MAX_DELAY", "2"))
+
+# Buffers that may still hold rows; flushed on shutdown
+_active_buffers = set()
+
+
+class WriteBehindBuffer:
+    """Collects keyed writes and flushes them in batches on size or time thresholds.
+
+    ``flush_rows(rows)`` receives a list of ``(key, value)`` pairs and returns the set
+    of keys that failed to write. Every buffered row carries the task result record
+    it belongs to; after its flush the record's ``writeStatus`` becomes ``"saved"`` or
+    ``"failed"`` (with an ``error`` entry), and ``on_saved(record)`` is called for
+    saved rows.
+    """
+
+    def __init__(self, flush_rows, max_rows=WRITE_BEHIND_MAX_ROWS, max_delay=WRITE_BEHIND_MAX_DELAY,
+                 on_saved=None):
+        self.flush_rows = flush_rows
+        self.on_saved = on_saved
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.timer = None
+        self.stats = {"rows": 0, "flushes": 0, "failed": 0}
+        _active_buffers.add(self)
+
+    async def add(self, key, value, record):
+        record["writeStatus"] = "pending"
+        self.pending.append((key, value, record))
+        if len(self.pending) >= self.max_rows:
+            # Shielded so a cancelled worker cannot abandon rows halfway through a flush
+            await asyncio.shield(self.flush())
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if self.timer is not None and self.timer is not asyncio.current_task():
+                self.timer.cancel()
+                self.timer = None
+
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+
+            try:
+                failed = await self.flush_rows([(key, value) for key, value, _ in batch])
+            except Exception as e:
+                print(f"❌ Write-behind flush of {len(batch)} row(s) failed: {e}")
+                failed = {key for key, _, _ in batch}
+
+            for key, _, record in batch:
+                if key in failed:
+                    record["writeStatus"] = "failed"
+                    record["error"] = "DB update failed"
+                else:
+                    record["writeStatus"] = "saved"
+                    if self.on_saved:
+                        self.on_saved(record)
+
+            self.stats["rows"] += len(batch)
+            self.stats["flushes"] += 1
+            self.stats["failed"] += len(failed)
+
+    async def close(self):
+        """Flush everything still buffered and stop tracking this buffer."""
+        try:
+            await asyncio.shield(self.flush())
+        finally:
+            _active_buffers.discard(self)
+
+
+async def flush_all_buffers():
+    for buffer in list(_active_buffers):
+        await buffer.close()